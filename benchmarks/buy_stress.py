@@ -0,0 +1,80 @@
+# Concurrency stress test for the purchase path (merchant.purchase_item).
+#
+# Creates a few scratch merchants with limited stock, fires hundreds of parallel purchases at them and
+# checks that no stock went below zero and that every successful purchase is accounted for.
+# Merchants don't share a lock, so buys against different items proceed in parallel.
+# The scratch guild is deleted afterwards.
+#
+# Needs the same ORACLE_* environment variables as the bot:
+#   python3 benchmarks/buy_stress.py [purchases] [merchants] [stock]
+
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from commands import db
+from commands.merchant import purchase_item
+
+GUILD_ID = 'bench-buy-stress'
+
+def create_merchants(cursor, merchants, stock):
+    items = []
+    for index in range(merchants):
+        character_id = cursor.var(int)
+        cursor.execute('''
+            INSERT INTO characters (guild_id, character_name, owner_id, image_url, background)
+            VALUES (:guild_id, :name, '0', NULL, NULL)
+            RETURNING id INTO :id
+        ''', {'guild_id': GUILD_ID, 'name': f'merchant {index}', 'id': character_id})
+        item_id = cursor.var(int)
+        cursor.execute('''
+            INSERT INTO inventory (id, character_id, name, quantity, info, price, discount, discount_threshold)
+            VALUES (inventory_seq.nextval, :character_id, 'potion', :stock, NULL, 1, 0, 0)
+            RETURNING id INTO :id
+        ''', {'character_id': character_id.getvalue()[0], 'stock': stock, 'id': item_id})
+        items.append(item_id.getvalue()[0])
+    return items
+
+def cleanup(cursor):
+    cursor.execute("DELETE FROM inventory WHERE character_id IN (SELECT id FROM characters WHERE guild_id = :guild_id)", {'guild_id': GUILD_ID})
+    cursor.execute("DELETE FROM characters WHERE guild_id = :guild_id", {'guild_id': GUILD_ID})
+
+async def buy(item_id, quantity):
+    return item_id, quantity, await db.transaction(purchase_item, item_id, quantity)
+
+async def main(purchases, merchants, stock):
+    await db.transaction(cleanup)
+    items = await db.transaction(create_merchants, merchants, stock)
+    try:
+        orders = [(random.choice(items), random.randint(1, 3)) for _ in range(purchases)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(buy(item_id, quantity) for item_id, quantity in orders))
+        elapsed = time.perf_counter() - start
+
+        sold = {item_id: 0 for item_id in items}
+        for item_id, quantity, remaining in results:
+            if remaining is not None:
+                assert remaining >= 0, f"item {item_id} went to {remaining}"
+                sold[item_id] += quantity
+
+        rows = await db.fetchall(
+            "SELECT id, quantity FROM inventory WHERE id IN (" + ', '.join(str(item_id) for item_id in items) + ")"
+        )
+        for item_id, quantity in rows:
+            assert quantity >= 0, f"item {item_id} has negative stock {quantity}"
+            assert quantity == stock - sold[item_id], f"item {item_id}: {quantity} left but {sold[item_id]} of {stock} sold"
+
+        succeeded = sum(1 for _, _, remaining in results if remaining is not None)
+        print(f"{purchases} purchases over {merchants} merchants in {elapsed:.2f}s ({purchases / elapsed:.0f}/s)")
+        print(f"{succeeded} succeeded, {purchases - succeeded} refused for lack of stock, no item oversold")
+    finally:
+        await db.transaction(cleanup)
+        db.close_pool()
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    asyncio.run(main(*(args + [500, 5, 100][len(args):])))
@@ -0,0 +1,72 @@
+# Load test for the non-blocking database layer.
+#
+# Runs N simulated commands at once, each doing one slow query, and measures
+# - how long each command takes, and
+# - how late a 50 ms heartbeat task on the same event loop wakes up (a stand-in for the gateway heartbeat)
+# once with the queries awaited through db.execute (the executor) and once called straight on the event loop,
+# which is how the commands used to run.
+#
+# Needs the same ORACLE_* environment variables as the bot:
+#   python3 benchmarks/db_load.py [concurrency]
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from commands import db
+
+SLOW_QUERY = "BEGIN DBMS_SESSION.SLEEP(0.05); END;"
+HEARTBEAT_INTERVAL = 0.05
+
+async def heartbeat(lags, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lags.append(time.perf_counter() - start - HEARTBEAT_INTERVAL)
+
+async def awaited_command():
+    start = time.perf_counter()
+    await db.execute(SLOW_QUERY)
+    return time.perf_counter() - start
+
+async def blocking_command():
+    start = time.perf_counter()
+    db._query(SLOW_QUERY, None, None)
+    return time.perf_counter() - start
+
+async def run_round(command, concurrency):
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    await asyncio.sleep(HEARTBEAT_INTERVAL)
+    latencies = await asyncio.gather(*(command() for _ in range(concurrency)))
+    stop.set()
+    await beat
+    return sorted(latencies), lags
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def main(concurrency):
+    db.create_pool()
+    # warm the pool so session creation isn't part of the measurement, the executor has a thread per pooled session
+    await asyncio.gather(*(db.execute(SLOW_QUERY) for _ in range(db.backend.WORKERS)))
+
+    print(f"{'mode':<10}{'commands':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'max loop lag ms':>18}")
+    for name, command in (('awaited', awaited_command), ('blocking', blocking_command)):
+        for n in (1, concurrency):
+            latencies, lags = await run_round(command, n)
+            print(f"{name:<10}{n:>10}"
+                  f"{statistics.median(latencies) * 1000:>10.1f}"
+                  f"{percentile(latencies, 95) * 1000:>10.1f}"
+                  f"{latencies[-1] * 1000:>10.1f}"
+                  f"{max(lags, default=0) * 1000:>18.1f}")
+
+    db.close_pool()
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
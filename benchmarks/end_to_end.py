@@ -0,0 +1,385 @@
+# End-to-end benchmark of the slash command handlers, with no Discord connection.
+#
+# Calls the real app_commands callbacks with stand-in Interaction, Guild, Channel and User objects. The database
+# is the SQLite backend in a temporary file, unless STORAGE_BACKEND and its settings point somewhere else (the
+# Oracle Free container works too; the scratch guilds are deleted afterwards). A local aiohttp server stands in
+# for Discord's webhook endpoint for /speak_as. Each command runs [iterations] times with up to [concurrency]
+# in flight, after the commands before it, so there are characters to view and items to buy.
+#
+# Reports p50/p95/p99 latency, database calls per command (counted by commands/metrics) and throughput, and
+# writes the results as JSON to benchmarks/results/. Pass the file of an earlier run to --compare to see the
+# change per command, for example between two commits.
+#   python3 benchmarks/end_to_end.py [--iterations N] [--concurrency N] [--output FILE] [--compare FILE]
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from aiohttp import web
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+# the backend is picked when commands is imported
+scratch = tempfile.TemporaryDirectory()
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(scratch.name, 'bench.sqlite3'))
+
+from commands import db, character, merchant, messaging
+from commands.backup import backup_scheduler
+from commands.receipts import receipt_publisher
+from commands.metrics import metrics, percentile
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+GUILD_ID = 900000000000000001
+# guild whose backup channel /init restores from
+RESTORE_GUILD_ID = 900000000000000002
+# characters the later commands spread over, and the size of the backup /init loads
+CHARACTERS = 20
+# the items /buy takes from every character, item 0 to item ITEMS_BOUGHT - 1
+ITEMS_BOUGHT = 2
+BACKUP_CHARACTERS = 50
+BACKUP_ITEMS = 10
+
+ids = itertools.count(1000)
+
+### STAND-INS ###
+
+class FakeUser:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.display_name = name
+        self.mention = f'<@{id}>'
+
+class FakeAttachment:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.size = len(data)
+        self._data = data
+
+    async def read(self):
+        return self._data
+
+class FakeMessage:
+    def __init__(self, channel=None, content=None, attachments=()):
+        self.id = next(ids)
+        self.channel = channel
+        self.content = content
+        self.attachments = list(attachments)
+
+    async def edit(self, **kwargs):
+        return self
+
+    async def delete(self, delay=None):
+        pass
+
+class FakeWebhook:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+
+class FakeChannel:
+    def __init__(self, guild, name):
+        self.id = next(ids)
+        self.guild = guild
+        self.name = name
+        self.mention = f'<#{self.id}>'
+        self.messages = []
+        self._webhooks = []
+
+    async def send(self, content=None, file=None, **kwargs):
+        attachments = [FakeAttachment(file.filename, file.fp.read())] if file else []
+        message = FakeMessage(self, content, attachments)
+        self.messages.append(message)
+        return message
+
+    async def history(self, limit=100, before=None):
+        messages = self.messages[::-1]
+        if before is not None:
+            messages = messages[messages.index(before) + 1:]
+        for message in messages[:limit]:
+            yield message
+
+    async def edit(self, **kwargs):
+        return self
+
+    async def webhooks(self):
+        return list(self._webhooks)
+
+    async def create_webhook(self, name):
+        webhook = FakeWebhook(name, f'{WebhookStandIn.base_url}/{self.id}/benchmark-token')
+        self._webhooks.append(webhook)
+        return webhook
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+        self.me = FakeUser(1, 'npc')
+        self.default_role = object()
+        self.filesize_limit = 10 * 1024 * 1024
+        self.text_channels = []
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.text_channels if channel.id == channel_id), None)
+
+    async def create_text_channel(self, name, overwrites=None):
+        channel = FakeChannel(self, name)
+        self.text_channels.append(channel)
+        return channel
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+
+    def is_done(self):
+        return self.done
+
+# Followups are kept so the benchmark can show the last reply of each command. Views are answered right away:
+# barter prompts are accepted, and paged inventories are closed as if the user walked away.
+class FakeFollowup:
+    def __init__(self):
+        self.replies = []
+
+    async def send(self, content=None, view=None, **kwargs):
+        self.replies.append(content)
+        if isinstance(view, merchant.BarterView):
+            view.result = 'barter'
+        if view is not None:
+            view.stop()
+        return FakeMessage(content=content)
+
+class FakeInteraction:
+    def __init__(self, command, guild, channel, user):
+        self.id = next(ids)
+        self.command = types.SimpleNamespace(qualified_name=command)
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.user = user
+        self.client = None
+        self.extras = {}
+        self.namespace = types.SimpleNamespace()
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+# accepts webhook posts the way Discord's execute endpoint does for ?wait=true
+class WebhookStandIn:
+    base_url = None
+
+    async def handle(self, request):
+        payload = await request.json()
+        return web.json_response({'id': str(next(ids)), 'content': payload.get('content')})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/api/webhooks/{webhook_id}/{token}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        WebhookStandIn.base_url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/api/webhooks'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+### SCENARIO ###
+
+# The handlers report most failures as a reply rather than an exception, so a run only counts as a success if its
+# last reply matches what the command answers when it worked.
+# (command, callback, arguments for run i, pattern of the success reply) in the order they run
+def scenario():
+    def name(i):
+        return f'character {i % CHARACTERS}'
+    return [
+        ('create_character', character.create_character, lambda i: {'name': f'character {i}', 'image_url': None, 'background': f'Background of character {i}'}, r"Character '.*' created"),
+        ('add_inventory', merchant.add_inventory, lambda i: {'character': name(i), 'item_name': f'item {i // CHARACTERS}', 'quantity': 1000000, 'price': 5, 'discount': 10 * (i % 2), 'discount_threshold': 10}, r"Item `.*` added"),
+        ('view_character', character.view_character, lambda i: {'character_name': name(i)}, r"Success!"),
+        ('allow_character', character.allow_character, lambda i: {'character_name': name(i), 'user': FakeUser(3 + i, f'player {i}')}, r"User .* can now use"),
+        ('see_inventory', merchant.see_inventory, lambda i: {'character': name(i), 'sort': 'price'}, r"Character `.*`'s inventory \(page"),
+        ('buy_item', merchant.buy_item, lambda i: {'character': name(i), 'item_name': 'item 0', 'quantity': 1}, r"Item `.*` bought"),
+        ('buy', merchant.buy, lambda i: {'character': name(i), 'items': ', '.join(f'item {item}:{item + 1}' for item in range(ITEMS_BOUGHT))}, r"Bought from character"),
+        ('speak_as', messaging.speak_as_character, lambda i: {'character_name': name(i), 'message': f'Line {i}'}, r"Success!"),
+        ('init', db.init, lambda i: {}, r"Characters loaded successfully"),
+        ('delete_character', character.delete_character, lambda i: {'name': f'character {i}'}, r"Character '.*' has been deleted"),
+    ]
+
+# runs a command needs at least, whatever --iterations says: every character has to be created, and be given
+# each of the items /buy takes (add_inventory gives item n to every character in runs n * CHARACTERS and on)
+MIN_RUNS = {
+    'create_character': CHARACTERS,
+    'add_inventory': ITEMS_BOUGHT * CHARACTERS,
+}
+
+def backup_snapshot():
+    characters = {}
+    for index in range(BACKUP_CHARACTERS):
+        characters[f'restored {index}'] = {
+            'owner_id': '2',
+            'image_url': None,
+            'background': f'Background of restored character {index}',
+            'allowed_users': ['2'],
+            'inventory': [{'name': f'item {item}', 'quantity': 10, 'info': None, 'price': 5, 'discount': 0, 'discount_threshold': 0} for item in range(BACKUP_ITEMS)],
+        }
+    return {'version': db.SNAPSHOT_VERSION, 'characters': characters}
+
+async def invoke(command, callback, guild, channel, user, kwargs, success, samples):
+    interaction = FakeInteraction(command, guild, channel, user)
+    metrics.command_started(interaction)
+    queries = interaction.extras['metrics'].queries
+    start = time.perf_counter()
+    raised = False
+    try:
+        await callback(interaction, **kwargs)
+    except Exception as e:
+        raised = True
+        interaction.followup.replies.append(f"{type(e).__name__}: {e}")
+    seconds = time.perf_counter() - start
+    replies = interaction.followup.replies[-1:]
+    failed = raised or not (replies and re.match(success, str(replies[0])))
+    samples.append((seconds, len(queries), sum(query for _, query in queries), failed, replies))
+    metrics.command_finished(interaction, raised)
+
+async def run_command(command, callback, arguments, success, guilds, user, iterations, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    samples = []
+    async def one(i):
+        async with slots:
+            guild, channel = guilds['restore' if command == 'init' else 'main']
+            await invoke(command, callback, guild, channel, user, arguments(i), success, samples)
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    timings = [sample[0] for sample in samples]
+    # the last failure's reply if there was one, it says more than a success
+    replies = [sample[4][0] for sample in sorted(samples, key=lambda sample: sample[3]) if sample[4]]
+    return {
+        'calls': len(samples),
+        'errors': sum(sample[3] for sample in samples),
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'queries_per_call': sum(sample[1] for sample in samples) / len(samples),
+        'db_ms_per_call': sum(sample[2] for sample in samples) / len(samples) * 1000,
+        'throughput_per_s': len(samples) / elapsed,
+        'last_reply': str(replies[-1])[:200] if replies else None,
+    }
+
+async def cleanup():
+    guild_ids = {'guild_id': str(GUILD_ID), 'restore_guild_id': str(RESTORE_GUILD_ID)}
+    for table in ('characters', 'transactions', 'guild_config', 'webhooks'):
+        await db.execute(f"DELETE FROM {table} WHERE guild_id IN (:guild_id, :restore_guild_id)", guild_ids)
+
+async def benchmark(iterations, concurrency):
+    stand_in = WebhookStandIn()
+    await stand_in.start()
+    db.create_pool()
+    await db.run(db.migrate)
+    await messaging.open_session()
+    await cleanup()
+
+    guild = FakeGuild(GUILD_ID)
+    channel = await guild.create_text_channel('general')
+    restore_guild = FakeGuild(RESTORE_GUILD_ID)
+    backup_channel = await restore_guild.create_text_channel('npc-character-backup')
+    await db.export_json_to_channel(backup_channel, backup_snapshot())
+    guilds = {'main': (guild, channel), 'restore': (restore_guild, channel)}
+    owner = FakeUser(2, 'game master')
+
+    results = {}
+    try:
+        for command, callback, arguments, success in scenario():
+            runs = max(iterations, MIN_RUNS.get(command, 0))
+            results[command] = await run_command(command, callback.callback, arguments, success, guilds, owner, runs, concurrency)
+        # the backups and receipts the commands scheduled, not timed
+        await backup_scheduler.flush()
+        await receipt_publisher.flush()
+    finally:
+        await cleanup()
+        await messaging.close_session()
+        db.close_pool()
+        await stand_in.stop()
+    return {
+        'background': {'backups': backup_scheduler.exports, 'receipts': receipt_publisher.stats()},
+        'commands': results,
+    }
+
+### REPORT ###
+
+# the commit the tree is at, with -dirty when it has changes since, so results aren't credited to code they didn't run
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain'], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '-dirty' if status.strip() else commit
+
+def print_results(results, baseline=None):
+    print(f"{results['backend']}, {results['iterations']} runs per command, {results['concurrency']} at a time, commit {results['commit']}")
+    header = f"{'command':<18}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'DB ms':>9}{'per s':>9}{'errors':>8}"
+    if baseline:
+        header += f"{'p50 vs ' + str(baseline.get('commit')):>20}{'queries vs':>12}"
+    print(header)
+    for command, stats in results['commands'].items():
+        line = (f"{command:<18}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                f"{stats['queries_per_call']:>9.1f}{stats['db_ms_per_call']:>9.2f}{stats['throughput_per_s']:>9.0f}{stats['errors']:>8}")
+        before = (baseline or {}).get('commands', {}).get(command)
+        if before:
+            change = (stats['p50_ms'] - before['p50_ms']) / before['p50_ms'] if before['p50_ms'] else 0.0
+            line += f"{change:>+20.0%}{stats['queries_per_call'] - before['queries_per_call']:>+12.1f}"
+        print(line)
+    for command, stats in results['commands'].items():
+        if stats['errors']:
+            print(f"/{command} failed {stats['errors']} times, last reply: {stats['last_reply']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the slash command handlers end to end without Discord")
+    parser.add_argument('--iterations', type=int, default=200, help="runs per command (default 200)")
+    parser.add_argument('--concurrency', type=int, default=8, help="runs of a command in flight at once (default 8)")
+    parser.add_argument('--output', help="where to write the JSON results (default benchmarks/results/end_to_end-<commit>-<backend>.json)")
+    parser.add_argument('--compare', metavar='FILE', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'backend': db.backend.NAME,
+        'iterations': args.iterations,
+        'concurrency': args.concurrency,
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+    results.update(asyncio.run(benchmark(args.iterations, args.concurrency)))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"end_to_end-{commit or 'unknown'}-{results['backend']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
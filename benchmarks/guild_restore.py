@@ -0,0 +1,83 @@
+# Benchmark for full-guild backups: exporting a snapshot with inventories (db.read_guild_snapshot) and
+# restoring it into an empty guild (db.import_characters) in one transaction.
+#
+# Creates a scratch guild with [characters] characters holding [items] items each, times the export and
+# serialization, wipes the guild, times the restore, then checks the restored snapshot matches the original.
+# Running the restore a second time shows the cost of loading a backup that changes nothing.
+# The scratch guild is deleted afterwards.
+#
+# Needs the same ORACLE_* environment variables as the bot:
+#   python3 benchmarks/guild_restore.py [characters] [items]
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from commands import db
+
+GUILD_ID = 'bench-guild-restore'
+
+def create_guild(cursor, characters, items):
+    snapshot = {}
+    for index in range(characters):
+        snapshot[f'character {index}'] = {
+            'owner_id': '0',
+            'image_url': None,
+            'background': f'Background of character {index}',
+            'allowed_users': ['0', str(index + 1)],
+            'inventory': [
+                {'name': f'item {item}', 'quantity': item, 'info': f'Info {item}' if item % 2 else None,
+                 'price': item + 1, 'discount': item % 50, 'discount_threshold': item % 5}
+                for item in range(items)
+            ],
+        }
+    return db.import_characters(cursor, GUILD_ID, snapshot)
+
+def cleanup(cursor):
+    cursor.execute("DELETE FROM character_permissions WHERE character_id IN (SELECT id FROM characters WHERE guild_id = :guild_id)", {'guild_id': GUILD_ID})
+    cursor.execute("DELETE FROM inventory WHERE character_id IN (SELECT id FROM characters WHERE guild_id = :guild_id)", {'guild_id': GUILD_ID})
+    cursor.execute("DELETE FROM characters WHERE guild_id = :guild_id", {'guild_id': GUILD_ID})
+
+# item ids are assigned on restore, compare everything else
+def comparable(snapshot):
+    return {
+        name: {**character, 'allowed_users': sorted(character['allowed_users']), 'inventory': sorted(map(db.normalise_item, character['inventory']))}
+        for name, character in snapshot['characters'].items()
+    }
+
+async def timed(label, coroutine):
+    start = time.perf_counter()
+    result = await coroutine
+    print(f"{label:<28}{(time.perf_counter() - start) * 1000:>10.0f} ms")
+    return result
+
+async def main(characters, items):
+    await db.transaction(cleanup)
+    await db.transaction(create_guild, characters, items)
+    try:
+        print(f"{characters} characters with {items} items each ({characters * items} items)")
+        snapshot = await timed('export snapshot', db.get_guild_snapshot(GUILD_ID))
+        content = await timed('serialize', asyncio.to_thread(db.serialize_backup, snapshot))
+        print(f"{'backup size':<28}{len(content[0]) / 1024:>10.0f} KiB ({content[1]})")
+
+        await db.transaction(cleanup)
+        data = db.snapshot_characters(json.loads(json.dumps(snapshot)))
+        report = await timed('restore into empty guild', db.transaction(db.import_characters, GUILD_ID, data))
+        assert report['inserted'] == characters and report['items'] == characters * items, report
+        report = await timed('restore unchanged guild', db.transaction(db.import_characters, GUILD_ID, data))
+        assert report['skipped'] == characters and report['items'] == 0, report
+
+        restored = await db.get_guild_snapshot(GUILD_ID)
+        assert comparable(restored) == comparable(snapshot), "restored guild differs from the backup"
+        print("restored guild matches the backup")
+    finally:
+        await db.transaction(cleanup)
+        db.close_pool()
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*(args + [200, 50][len(args):])))
@@ -0,0 +1,113 @@
+# Benchmark for the character and inventory lookup indexes (migration 0003_add_lookup_indexes).
+#
+# Seeds scratch copies of the characters and inventory tables (100k characters, 1M items by default),
+# times the lookups the commands run, adds the same indexes as the migration and times them again.
+# The scratch tables are dropped afterwards; the bot's own tables are not touched.
+#
+# Point the ORACLE_* environment variables at a local Oracle Free container, e.g. the docker compose one:
+#   python3 benchmarks/lookup_indexes.py [characters] [items]
+
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from commands import create_oracle_connection, close_pool
+
+GUILDS = 1000
+SAMPLES = 500
+
+LOOKUPS = {
+    'get_character': (
+        "SELECT id, character_name, owner_id, image_url, background FROM bench_characters WHERE guild_id = :guild_id AND character_name = :name",
+        lambda c, items_per: {'guild_id': f'guild {c % GUILDS}', 'name': f'character {c}'},
+    ),
+    'get_inventory_item': (
+        "SELECT * FROM bench_inventory WHERE character_id = :character_id AND name = :name",
+        lambda c, items_per: {'character_id': c, 'name': f'item {random.randrange(items_per)}'},
+    ),
+    'get_all_inventory': (
+        "SELECT * FROM bench_inventory WHERE character_id = :character_id ORDER BY id",
+        lambda c, items_per: {'character_id': c},
+    ),
+}
+
+def drop_tables(cursor):
+    for table in ('bench_inventory', 'bench_characters'):
+        cursor.execute(f"SELECT table_name FROM user_tables WHERE table_name = '{table.upper()}'")
+        if cursor.fetchone():
+            cursor.execute(f"DROP TABLE {table} PURGE")
+
+def seed(cursor, characters, items):
+    items_per = items // characters
+    cursor.execute("""
+        CREATE TABLE bench_characters (
+            id NUMBER(10) PRIMARY KEY, guild_id VARCHAR2(50), character_name VARCHAR2(50),
+            owner_id VARCHAR2(50), image_url VARCHAR2(255), background VARCHAR2(1000)
+        )
+    """)
+    cursor.execute("""
+        INSERT /*+ APPEND */ INTO bench_characters
+        SELECT level, 'guild ' || MOD(level, :guilds), 'character ' || level, '1', 'https://example.com/a.png', 'A character'
+        FROM dual CONNECT BY level <= :characters
+    """, {'guilds': GUILDS, 'characters': characters})
+    cursor.connection.commit()
+    cursor.execute("""
+        CREATE TABLE bench_inventory (
+            id NUMBER(10) PRIMARY KEY, character_id NUMBER(10) NOT NULL REFERENCES bench_characters(id),
+            name VARCHAR2(100) NOT NULL, quantity NUMBER(10) NOT NULL, info VARCHAR2(255),
+            price NUMBER(10) NOT NULL, discount NUMBER(10), discount_threshold NUMBER(10)
+        )
+    """)
+    cursor.execute("""
+        INSERT /*+ APPEND */ INTO bench_inventory
+        SELECT level, CEIL(level / :items_per), 'item ' || MOD(level - 1, :items_per), 10, NULL, 5, 0, 0
+        FROM dual CONNECT BY level <= :items
+    """, {'items_per': items_per, 'items': items_per * characters})
+    cursor.connection.commit()
+    return items_per
+
+def add_indexes(cursor):
+    cursor.execute("CREATE UNIQUE INDEX bench_characters_guild_name_uk ON bench_characters (guild_id, character_name)")
+    cursor.execute("CREATE UNIQUE INDEX bench_inventory_character_name_uk ON bench_inventory (character_id, name)")
+
+def measure(cursor, characters, items_per):
+    results = {}
+    for name, (sql, params) in LOOKUPS.items():
+        timings = []
+        for _ in range(SAMPLES):
+            bind = params(random.randint(1, characters), items_per)
+            start = time.perf_counter()
+            cursor.execute(sql, bind)
+            cursor.fetchall()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        results[name] = (statistics.median(timings) * 1000, timings[int(len(timings) * 0.95)] * 1000)
+    return results
+
+def main(characters, items):
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    drop_tables(cursor)
+    try:
+        print(f"Seeding {characters} characters and {items} items...", flush=True)
+        items_per = seed(cursor, characters, items)
+        before = measure(cursor, characters, items_per)
+        add_indexes(cursor)
+        after = measure(cursor, characters, items_per)
+
+        print(f"{'lookup':<22}{'before p50':>12}{'before p95':>12}{'after p50':>12}{'after p95':>12}   (ms)")
+        for name in LOOKUPS:
+            print(f"{name:<22}{before[name][0]:>12.2f}{before[name][1]:>12.2f}{after[name][0]:>12.2f}{after[name][1]:>12.2f}")
+    finally:
+        drop_tables(cursor)
+        cursor.close()
+        connection.close()
+        close_pool()
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*(args + [100_000, 1_000_000][len(args):]))
@@ -0,0 +1,120 @@
+# Per-command database latency of the storage backends side by side (commands/storage).
+#
+# Each backend runs in its own process, since STORAGE_BACKEND is read at import time. The worker replays the
+# database calls a handful of commands make, one command at a time, against a scratch guild and reports
+# p50/p95 per command; the scratch guild is deleted afterwards. SQLite uses a temporary database file.
+# The Oracle run needs the same ORACLE_* environment variables as the bot, and is skipped if it can't connect.
+#   python3 benchmarks/storage_backends.py [iterations] [backend ...]
+
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+GUILD_ID = 'bench-storage'
+COMMANDS = ['create_character', 'view_character', 'allow_character', 'add_inventory', 'see_inventory', 'buy_item', 'delete_character']
+
+async def worker(iterations):
+    from commands import db, character, merchant
+    from commands.cache import character_cache, permission_cache
+
+    async def create_character(index):
+        await db.transaction(character.insert_character, GUILD_ID, f'character {index}', '0', None, 'Benchmark character')
+
+    async def view_character(index):
+        character_cache.clear()
+        ch = await character.get_character(GUILD_ID, f'character {index}')
+        await character.get_allowed_users(ch['id'])
+        return ch
+
+    async def allow_character(index):
+        ch = await view_character(index)
+        permission_cache.clear()
+        await character.is_allowed(ch['id'], '0')
+        await db.transaction(db.backend.allow_user, ch['id'], '1')
+
+    async def add_inventory(index):
+        ch = await view_character(index)
+        for item in range(10):
+            if not await merchant.get_inventory_item(ch['id'], f'item {item}'):
+                await db.transaction(db.backend.insert_items, [{
+                    'character_id': ch['id'], 'name': f'item {item}', 'quantity': 100, 'info': 'Benchmark item',
+                    'price': 5, 'discount': 0, 'discount_threshold': 0,
+                }])
+
+    async def see_inventory(index):
+        ch = await view_character(index)
+        await merchant.get_inventory_page(ch['id'], 'price')
+
+    async def buy_item(index):
+        ch = await view_character(index)
+        item = await merchant.get_inventory_item(ch['id'], 'item 0')
+        await db.transaction(merchant.purchase_item, item['id'], 1)
+
+    async def delete_character(index):
+        await db.execute("DELETE FROM characters WHERE guild_id = :guild_id AND character_name = :name", {'guild_id': GUILD_ID, 'name': f'character {index}'})
+
+    async def cleanup():
+        await db.execute("DELETE FROM characters WHERE guild_id = :guild_id", {'guild_id': GUILD_ID})
+
+    commands = {
+        'create_character': create_character, 'view_character': view_character, 'allow_character': allow_character,
+        'add_inventory': add_inventory, 'see_inventory': see_inventory, 'buy_item': buy_item, 'delete_character': delete_character,
+    }
+    db.create_pool()
+    await db.run(db.migrate)
+    await cleanup()
+    results = {}
+    try:
+        for name in COMMANDS:
+            command = commands[name]
+            timings = []
+            for index in range(iterations):
+                start = time.perf_counter()
+                await command(index)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            # add_inventory runs 10 lookups + inserts, report it per item like the command
+            scale = 10 if name == 'add_inventory' else 1
+            results[name] = {
+                'p50': statistics.median(timings) / scale,
+                'p95': timings[int(len(timings) * 0.95)] / scale,
+            }
+    finally:
+        await cleanup()
+        db.close_pool()
+    print(json.dumps(results))
+
+def run_backend(backend, iterations):
+    env = {**os.environ, 'STORAGE_BACKEND': backend}
+    with tempfile.TemporaryDirectory() as directory:
+        env.setdefault('SQLITE_PATH', os.path.join(directory, 'bench.sqlite3'))
+        process = subprocess.run([sys.executable, __file__, '--worker', str(iterations)], env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        print(f"{backend}: skipped, {process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'worker failed'}")
+        return None
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def main(iterations, backends):
+    results = {backend: run_backend(backend, iterations) for backend in backends}
+    results = {backend: result for backend, result in results.items() if result}
+    header = f"{'command':<18}" + ''.join(f"{backend + ' p50':>14}{backend + ' p95':>14}" for backend in results)
+    print(f"{iterations} runs per command, milliseconds")
+    print(header)
+    for name in COMMANDS:
+        print(f"{name:<18}" + ''.join(
+            f"{results[backend][name]['p50'] * 1000:>14.2f}{results[backend][name]['p95'] * 1000:>14.2f}" for backend in results
+        ))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        asyncio.run(worker(int(sys.argv[2])))
+    else:
+        iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+        main(iterations, sys.argv[2:] or ['oracle', 'sqlite'])
@@ -0,0 +1,103 @@
+# Checks the webhook send queue (commands/send_queue.py) against a local fake webhook server that enforces
+# Discord-style rate limits: 5 messages per 2 seconds per webhook, with X-RateLimit-* headers on every
+# response and a 429 + Retry-After once a bucket is used up. A few requests also fail with a 502.
+#
+# Sends bursts of messages to several webhooks at once and asserts every message arrives exactly once and in order.
+# Needs no token or network.
+#   python3 benchmarks/webhook_rate_limits.py [messages per webhook] [webhooks]
+
+import asyncio
+import os
+import random
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from commands.send_queue import WebhookSendQueue
+
+BUCKET_SIZE = 5
+BUCKET_WINDOW = 2.0
+ERROR_RATE = 0.05
+
+class FakeWebhookServer:
+    def __init__(self):
+        self.received = {}
+        self.windows = {}
+        self.rate_limited = 0
+        self.errors = 0
+
+    async def handle(self, request):
+        webhook_id = request.match_info['webhook_id']
+        payload = await request.json()
+        now = time.monotonic()
+        window_start, used = self.windows.get(webhook_id, (now, 0))
+        if now - window_start >= BUCKET_WINDOW:
+            window_start, used = now, 0
+        reset_after = BUCKET_WINDOW - (now - window_start)
+
+        if used >= BUCKET_SIZE:
+            self.rate_limited += 1
+            return web.json_response(
+                {'message': 'You are being rate limited.', 'retry_after': round(reset_after, 3), 'global': False},
+                status=429,
+                headers={'Retry-After': str(max(1, round(reset_after))), 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': f'{reset_after:.3f}'},
+            )
+        if random.random() < ERROR_RATE:
+            self.errors += 1
+            return web.Response(status=502, text='Bad Gateway')
+
+        self.windows[webhook_id] = (window_start, used + 1)
+        self.received.setdefault(webhook_id, []).append(payload['content'])
+        return web.json_response(
+            {'id': str(len(self.received[webhook_id])), 'content': payload['content']},
+            headers={'X-RateLimit-Remaining': str(BUCKET_SIZE - used - 1), 'X-RateLimit-Reset-After': f'{reset_after:.3f}'},
+        )
+
+async def main(messages, webhooks):
+    server = FakeWebhookServer()
+    app = web.Application()
+    app.router.add_post('/api/webhooks/{webhook_id}/{token}', server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    session = aiohttp.ClientSession()
+    async def session_factory():
+        return session
+    queue = WebhookSendQueue(session_factory)
+
+    try:
+        start = time.perf_counter()
+        # each webhook's lines are queued in order, all webhooks at once
+        sends = []
+        for index in range(messages):
+            for webhook in range(webhooks):
+                sends.append(asyncio.ensure_future(queue.send(
+                    f'http://127.0.0.1:{port}/api/webhooks/{webhook}/token', {'content': f'line {index}', 'username': 'Benchmark'}
+                )))
+        await asyncio.sleep(0)
+        peak_depth = queue.stats()['queue_depth']
+        await asyncio.gather(*sends)
+        elapsed = time.perf_counter() - start
+
+        for webhook in range(webhooks):
+            assert server.received[str(webhook)] == [f'line {index}' for index in range(messages)], f"webhook {webhook} lost or reordered messages"
+
+        stats = queue.stats()
+        print(f"{messages * webhooks} messages over {webhooks} webhooks delivered in order in {elapsed:.1f}s")
+        print(f"server answered {server.rate_limited} requests with 429 and {server.errors} with 502")
+        print(f"peak queue depth {peak_depth}, retries {stats['retries']}, rate limited {stats['rate_limited']}, "
+              f"avg wait {stats['avg_wait'] * 1000:.0f} ms, max wait {stats['max_wait'] * 1000:.0f} ms")
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*(args + [20, 3][len(args):])))
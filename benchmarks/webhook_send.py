@@ -0,0 +1,77 @@
+# Micro-benchmark for webhook sends: a new aiohttp.ClientSession per message (how /speak_as used to send)
+# against the shared keep-alive session in messaging.send_webhook_message.
+#
+# Runs against a local aiohttp server standing in for Discord's webhook endpoint, so it needs no token or network.
+# The stand-in speaks plain HTTP; against the real API the per-message session also pays a TLS handshake,
+# so the gap there is larger than reported here.
+#   python3 benchmarks/webhook_send.py [messages]
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+import discord
+from aiohttp import web
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from commands import messaging
+
+WEBHOOK_ID = '123456789012345678'
+WEBHOOK_TOKEN = 'benchmark-token-' + 'x' * 52
+
+async def handle_execute(request):
+    await request.read()
+    return web.json_response({'id': '1', 'content': 'Hello there'})
+
+async def start_stand_in():
+    app = web.Application()
+    app.router.add_post('/api/v10/webhooks/{webhook_id}/{token}', handle_execute)
+    app.router.add_post('/api/webhooks/{webhook_id}/{token}', handle_execute)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    # discord.py builds webhook URLs from this base, point it at the stand-in
+    discord.webhook.async_.Route.BASE = f'http://127.0.0.1:{port}/api/v10'
+    return runner, f'http://127.0.0.1:{port}/api/webhooks/{WEBHOOK_ID}/{WEBHOOK_TOKEN}'
+
+async def send_with_new_session(webhook_url):
+    async with aiohttp.ClientSession() as session:
+        webhook = discord.Webhook.from_url(f'https://discord.com/api/webhooks/{WEBHOOK_ID}/{WEBHOOK_TOKEN}', session=session)
+        await webhook.send(content='Hello there', username='Benchmark', avatar_url=None)
+
+async def send_with_shared_session(webhook_url):
+    await messaging.send_webhook_message(webhook_url, 'Benchmark', None, 'Hello there')
+
+async def measure(send, webhook_url, messages):
+    timings = []
+    for _ in range(messages):
+        start = time.perf_counter()
+        await send(webhook_url)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings
+
+async def main(messages):
+    runner, webhook_url = await start_stand_in()
+    await messaging.open_session()
+    try:
+        print(f"{'session':<10}{'messages':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, send in (('per-send', send_with_new_session), ('shared', send_with_shared_session)):
+            await send(webhook_url)  # warm up
+            timings = await measure(send, webhook_url, messages)
+            print(f"{name:<10}{messages:>10}"
+                  f"{statistics.mean(timings) * 1000:>10.2f}"
+                  f"{statistics.median(timings) * 1000:>10.2f}"
+                  f"{timings[int(len(timings) * 0.95)] * 1000:>10.2f}")
+    finally:
+        await messaging.close_session()
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
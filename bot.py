@@ -1,47 +1,118 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from commands import * 
-from db_migrations import run_migrations
+from commands import db
+from commands import messaging
+from commands.backup import backup_scheduler
+from commands.receipts import receipt_publisher
+from commands.name_index import name_index
+from commands.shards import shard_config, format_shard_stats
+from commands.metrics import metrics, InstrumentedTree, start_metrics_server
+import asyncio
+import hashlib
+import json
 import os
+import signal
 import time
 
+STARTED = time.perf_counter()
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+
+# hash of the last command tree synced with Discord, so restarts without command changes skip the sync
+COMMAND_HASH_FILE = os.environ.get('COMMAND_HASH_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.command_tree_hash'))
+
+async def timed(phase, awaitable):
+    start = time.perf_counter()
+    result = await awaitable
+    print(f"Startup: {phase} took {(time.perf_counter() - start) * 1000:.0f} ms", flush=True)
+    return result
+
+# seconds between per-shard latency and guild count reports in the log, 0 to turn them off
+SHARD_REPORT_INTERVAL = float(os.environ.get('SHARD_REPORT_INTERVAL', 300))
+
+# Runs every shard Discord recommends in this process, or the SHARD_IDS out of SHARD_COUNT when launched by launcher.py
+class NpcBot(commands.AutoShardedBot):
+    startup_logged = False
+    metrics_server = None
+    name_index_preload = None
+
+    # The bot owns the shared Oracle pool and webhook HTTP session: opened before connecting to Discord, closed on shutdown.
+    # setup_hook runs once per process, unlike on_ready which fires again after every reconnect.
+    async def setup_hook(self):
+        start = time.perf_counter()
+        create_pool()
+        await messaging.open_session()
+        self.metrics_server = await start_metrics_server(self)
+        print(f"Startup: pool and HTTP session took {(time.perf_counter() - start) * 1000:.0f} ms", flush=True)
+        # neither needs the gateway, so they run while it connects
+        self.schema_ready = asyncio.create_task(timed('migrations', db.run(db.migrate)))
+        # commands are global, with several processes only the one running shard 0 syncs them
+        if not self.shard_ids or 0 in self.shard_ids:
+            self.commands_synced = asyncio.create_task(timed('command sync', self.sync_commands()))
+        if SHARD_REPORT_INTERVAL > 0:
+            self.report_shards.change_interval(seconds=SHARD_REPORT_INTERVAL)
+            self.report_shards.start()
+
+    @tasks.loop(seconds=300)
+    async def report_shards(self):
+        await self.wait_until_ready()
+        print(format_shard_stats(self), flush=True)
+
+    def command_tree_hash(self):
+        tree = [command.to_dict(self.tree) for command in self.tree.get_commands()]
+        payload = json.dumps({'application_id': self.application_id, 'commands': tree}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # global syncs are rate limited, only sync when the commands changed since the last one
+    async def sync_commands(self):
+        tree_hash = self.command_tree_hash()
+        try:
+            with open(COMMAND_HASH_FILE) as f:
+                if f.read().strip() == tree_hash:
+                    print("Commands unchanged since the last sync, skipping it", flush=True)
+                    return
+        except FileNotFoundError:
+            pass
+        await self.tree.sync()
+        with open(COMMAND_HASH_FILE, 'w') as f:
+            f.write(tree_hash)
+
+    async def close(self):
+        # upload backups for guilds edited during the last window while we can still reach Discord
+        await backup_scheduler.flush()
+        await receipt_publisher.flush()
+        self.report_shards.cancel()
+        await super().close()
+        await messaging.close_session()
+        if self.metrics_server:
+            await self.metrics_server.cleanup()
+        close_pool()
+
+bot = NpcBot(command_prefix='/', intents=intents, tree_cls=InstrumentedTree, **shard_config())
 
 ### START UP ###
 @bot.event
 async def on_ready():
-    await bot.tree.sync()  # Sync the / commands with Discord
-    create_character_table()
-
-    run_migrations.main()
-
-def create_character_table():
-    connection = create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute('''
-        SELECT table_name 
-        FROM user_tables 
-        WHERE table_name = 'CHARACTERS'
-    ''')
-    table_exists = cursor.fetchone()
-    
-    if not table_exists:
-        cursor.execute('''
-            CREATE TABLE characters (
-                guild_id VARCHAR2(50),
-                character_name VARCHAR2(50),
-                owner_id VARCHAR2(50),
-                image_url VARCHAR2(255),
-                background VARCHAR2(1000),
-                allowed_users CLOB
-            )
-        ''')
-        connection.commit()
-    cursor.close()
-    connection.close()
-    print("Characters table created successfully.")
+    await bot.schema_ready
+    # fill the autocomplete index now rather than on the first keystroke in each guild, guilds loaded before a reconnect are skipped
+    if bot.name_index_preload is None or bot.name_index_preload.done():
+        bot.name_index_preload = asyncio.create_task(name_index.preload([str(guild.id) for guild in bot.guilds]))
+    # post receipts of purchases made before a restart that didn't make it to the transactions channel
+    await receipt_publisher.resume(bot)
+    if not bot.startup_logged:
+        bot.startup_logged = True
+        print(f"Startup: ready {time.perf_counter() - STARTED:.1f} s after the bot started", flush=True)
+        print(format_shard_stats(bot), flush=True)
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    metrics.command_finished(interaction)
+
+@bot.event
+async def on_shard_ready(shard_id):
+    print(f"Shard {shard_id} ready", flush=True)
 
 ### CHARACTER COMMANDS ###
 bot.tree.add_command(create_character)
@@ -65,6 +136,17 @@ bot.tree.add_command(add_stock)
 bot.tree.add_command(remove_inventory)
 bot.tree.add_command(see_inventory)
 bot.tree.add_command(buy_item)
+bot.tree.add_command(buy)
 bot.tree.add_command(edit_inventory)
+bot.tree.add_command(import_inventory)
+bot.tree.add_command(export_inventory)
+
+### BOT ADMINISTRATION ###
+bot.tree.add_command(npc_stats)
+bot.tree.add_command(npc_config)
+
+# docker stop and systemd send SIGTERM, which discord.py doesn't handle. Pass it on as SIGINT, which bot.run
+# answers like Ctrl+C by closing the bot, so pending backups and receipts are flushed first.
+signal.signal(signal.SIGTERM, lambda signum, frame: signal.raise_signal(signal.SIGINT))
 
 bot.run(os.getenv('DISCORD_TOKEN'))
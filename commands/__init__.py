@@ -1,7 +1,10 @@
 from .character import create_character, delete_character, delete_all_characters, edit_character, allow_character, view_character
-from .db import init, load_characters_from_message, export_characters_manual, create_oracle_connection
+from .db import init, load_characters_from_message, export_characters_manual, create_oracle_connection, create_pool, close_pool
 from .messaging import speak_as_character
-from .merchant import add_inventory, add_stock, remove_inventory, see_inventory, buy_item, edit_inventory
+from .merchant import add_inventory, add_stock, remove_inventory, see_inventory, buy_item, buy, edit_inventory
+from .inventory_files import import_inventory, export_inventory
+from .metrics import npc_stats
+from .guild_config import npc_config
 
 __all__ = [
     'create_character',
@@ -15,10 +18,17 @@ __all__ = [
     'export_characters_manual',
     'speak_as_character',
     'create_oracle_connection',
+    'create_pool',
+    'close_pool',
     'add_inventory',
     'add_stock',
     'remove_inventory',
     'see_inventory',
     'buy_item',
-    'edit_inventory'
+    'buy',
+    'edit_inventory',
+    'import_inventory',
+    'export_inventory',
+    'npc_stats',
+    'npc_config'
 ]
\ No newline at end of file
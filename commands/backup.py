@@ -0,0 +1,74 @@
+import asyncio
+import os
+import discord
+from . import db
+
+# Runs action(guild) at the end of a window of delay seconds that the guild's first schedule() starts. Later calls
+# during the window are folded into that run. The window closes before the action runs, so changes made while it
+# is running start a window of their own.
+class GuildDebounce:
+    def __init__(self, delay, action):
+        self.delay = delay
+        self.action = action
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    # returns whether this call started a window, rather than joining a pending one
+    def schedule(self, guild: discord.Guild):
+        if guild.id in self._pending:
+            return False
+        self._pending[guild.id] = (guild, asyncio.create_task(self._run_later(guild)))
+        return True
+
+    async def _run_later(self, guild):
+        await asyncio.sleep(self.delay)
+        self._pending.pop(guild.id, None)
+        await self.action(guild)
+
+    # run every pending guild right away, used on shutdown
+    async def flush(self):
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for _, task in pending:
+            task.cancel()
+        await asyncio.gather(*(self.action(guild) for guild, _ in pending))
+
+# Collects character mutations per guild and uploads one backup per window instead of one per mutation.
+# The first mutation marks the guild dirty and starts the window; later ones within it only bump the counters.
+class BackupScheduler:
+    def __init__(self, delay):
+        self.requested = 0
+        self.exports = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._debounce = GuildDebounce(delay, self._export)
+
+    def schedule(self, guild: discord.Guild):
+        self.requested += 1
+        if not self._debounce.schedule(guild):
+            self.coalesced += 1
+
+    async def _export(self, guild):
+        try:
+            await db.export_guild(guild)
+            self.exports += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Backup export for guild {guild.id} failed: {e}")
+
+    # export every dirty guild right away, used on shutdown
+    async def flush(self):
+        await self._debounce.flush()
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'exports': self.exports,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+            'pending': len(self._debounce),
+        }
+
+backup_scheduler = BackupScheduler(delay=float(os.environ.get('BACKUP_DELAY', 30)))
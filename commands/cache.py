@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+
+# Bounded LRU cache whose entries also expire after ttl seconds.
+# Only touched from the event loop, so it needs no locking.
+#
+# Loads that await the database race with invalidations: a load that read the old row before an edit
+# and stores it after the edit's invalidate would cache the old row for the whole ttl. Every invalidation
+# bumps the key's generation, so a load reads generation(key) before querying and passes it to set(),
+# which drops the value if the key was invalidated in between.
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # key -> counter value of its last invalidation, bounded like the entries. Keys without one are at
+        # the floor, the newest counter value forgotten or handed to every key by a bulk invalidation.
+        self._counter = 0
+        self._floor = 0
+        self._generations = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def generation(self, key):
+        return self._generations.get(key, self._floor)
+
+    def set(self, key, value, generation=None):
+        if generation is not None and generation != self.generation(key):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._counter += 1
+        self._generations[key] = self._counter
+        self._generations.move_to_end(key)
+        while len(self._generations) > self.maxsize:
+            _, forgotten = self._generations.popitem(last=False)
+            self._floor = max(self._floor, forgotten)
+
+    # drop every entry whose key is a tuple starting with prefix, e.g. all characters of one guild
+    def invalidate_prefix(self, *prefix):
+        for key in [key for key in self._entries if key[:len(prefix)] == prefix]:
+            del self._entries[key]
+        self._invalidate_all_loads()
+
+    def clear(self):
+        self._entries.clear()
+        self._invalidate_all_loads()
+
+    # bulk invalidations move every key to a new generation, loads in flight for any key are dropped
+    def _invalidate_all_loads(self):
+        self._counter += 1
+        self._floor = self._counter
+        self._generations.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+# decoded character rows keyed by (guild_id, character_name)
+character_cache = TTLCache(
+    maxsize=int(os.environ.get('CHARACTER_CACHE_SIZE', 2048)),
+    ttl=float(os.environ.get('CHARACTER_CACHE_TTL', 300)),
+)
+
+# results of permission checks keyed by (character_id, user_id)
+permission_cache = TTLCache(
+    maxsize=int(os.environ.get('PERMISSION_CACHE_SIZE', 8192)),
+    ttl=float(os.environ.get('CHARACTER_CACHE_TTL', 300)),
+)
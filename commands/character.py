@@ -1,7 +1,9 @@
 import discord
 from discord import app_commands
-import json
 from . import db
+from .backup import backup_scheduler
+from .cache import character_cache, permission_cache
+from .name_index import name_index, character_autocomplete
 
 async def owner_check(interaction, character):
     user_id = str(interaction.user.id)
@@ -12,37 +14,84 @@ async def owner_check(interaction, character):
 
 async def allowed_users_check(interaction, character, send_followup=True):
     user_id = str(interaction.user.id)
-    if user_id not in character['allowed_users']:
+    if not await is_allowed(character['id'], user_id):
         if send_followup:
             await interaction.followup.send("You do not have permission to use this character.", ephemeral=True)
         return False
     return True
 
-def get_character(guild_id, name):
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
+async def is_allowed(character_id, user_id):
+    allowed = permission_cache.get((character_id, user_id))
+    if allowed is None:
+        generation = permission_cache.generation((character_id, user_id))
+        allowed = await db.fetchone(
+            "SELECT 1 FROM character_permissions WHERE character_id = :character_id AND user_id = :user_id",
+            {"character_id": character_id, "user_id": user_id}
+        ) is not None
+        permission_cache.set((character_id, user_id), allowed, generation)
+    return allowed
 
-    cursor.execute('''
-        SELECT id, character_name, owner_id, image_url, background, allowed_users
+async def get_allowed_users(character_id):
+    rows = await db.fetchall("SELECT user_id FROM character_permissions WHERE character_id = :character_id ORDER BY user_id", {"character_id": character_id})
+    return [row[0] for row in rows]
+
+async def get_character(guild_id, name):
+    character = character_cache.get((guild_id, name))
+    if character:
+        return copy_character(character)
+
+    # an edit or delete finishing while the row is read must not be overwritten by the old row
+    generation = character_cache.generation((guild_id, name))
+    character = await db.fetchone('''
+        SELECT id, character_name, owner_id, image_url, background
         FROM characters
         WHERE guild_id = :guild_id AND character_name = :name
     ''', {"guild_id": guild_id, "name": name})
 
-    character = cursor.fetchone()
     if character:
         character = {
             "id": character[0],
             "name": character[1],
             "owner_id": character[2],
             "image_url": character[3],
-            "background": character[4],
-            "allowed_users": json.loads(character[5].read())
+            "background": character[4]
         }
-
-    cursor.close()
-    connection.close()
+        character_cache.set((guild_id, name), character, generation)
+        return copy_character(character)
     return character
 
+# callers edit the dict they get back, so never hand out the cached one
+def copy_character(character):
+    return dict(character)
+
+def delete_character_rows(cursor, guild_id, name):
+    sql = "SELECT id FROM characters WHERE guild_id = :guild_id"
+    params = {"guild_id": guild_id}
+    if name is not None:
+        sql += " AND character_name = :name"
+        params["name"] = name
+    cursor.execute(sql, params)
+    character_ids = [row[0] for row in cursor.fetchall()]
+    # delete exactly the characters that were read, so every deleted id is known
+    if character_ids:
+        cursor.executemany("DELETE FROM characters WHERE id = :id", [{"id": character_id} for character_id in character_ids])
+    return character_ids
+
+# Delete one character of a guild, or all of them without a name. The permission checks cached for the
+# deleted characters are dropped too, they would otherwise keep granting access until they expire.
+async def delete_characters(guild_id, name=None):
+    character_ids = await db.transaction(delete_character_rows, guild_id, name)
+    for character_id in character_ids:
+        permission_cache.invalidate_prefix(character_id)
+    return character_ids
+
+def insert_character(cursor, guild_id, name, owner_id, image_url, background):
+    character_id = db.backend.insert_character(cursor, guild_id, name, owner_id, image_url, background)
+    cursor.execute(
+        "INSERT INTO character_permissions (character_id, user_id) VALUES (:character_id, :user_id)",
+        {"character_id": character_id, "user_id": owner_id}
+    )
+
 @app_commands.command(name='create_character', description="Create a character specific to this guild.")
 @app_commands.describe(
     name="The name of the character to edit (50 character limit)",
@@ -53,7 +102,7 @@ async def create_character(interaction: discord.Interaction, name: str, image_ur
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
 
-    if get_character(guild_id, name):
+    if await get_character(guild_id, name):
         await interaction.followup.send(f"A character with the name '{name}' already exists in this guild!", ephemeral=True)
         return
 
@@ -61,33 +110,20 @@ async def create_character(interaction: discord.Interaction, name: str, image_ur
     user_id = str(user.id) 
 
     try:
-        connection = db.create_oracle_connection()
-        cursor = connection.cursor()
-        cursor.execute('''
-            INSERT INTO characters (guild_id, character_name, owner_id, image_url, background, allowed_users)
-            VALUES (:guild_id, :name, :owner_id, :image_url, :background, :allowed_users)
-        ''', {
-            "guild_id": guild_id, 
-            "name": name, 
-            "owner_id": user_id, 
-            "image_url": image_url, 
-            "background": background, 
-            "allowed_users": json.dumps([user_id])
-        })
-        connection.commit()
+        await db.transaction(insert_character, guild_id, name, user_id, image_url, background)
+        character_cache.invalidate((guild_id, name))
+        name_index.add_character(guild_id, name)
         await interaction.followup.send(f"Character '{name}' created and saved for this guild.", ephemeral=True)
-        await db.export_characters(interaction, send_messages=False)
+        backup_scheduler.schedule(interaction.guild)
     except Exception as e:
         await interaction.followup.send(f"Failed to create character due to an error: {str(e)}", ephemeral=True)
-    finally:
-        cursor.close()
-        connection.close()
 
 @app_commands.command(name='delete_character', description="Delete a character from this guild.")
+@app_commands.autocomplete(name=character_autocomplete)
 async def delete_character(interaction: discord.Interaction, name: str):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    character = get_character(guild_id, name)
+    character = await get_character(guild_id, name)
     if not character:
         await interaction.followup.send(f"Character '{name}' does not exist in this guild.", ephemeral=True)
         return
@@ -96,20 +132,13 @@ async def delete_character(interaction: discord.Interaction, name: str):
         return
 
     try: 
-        connection = db.create_oracle_connection()
-        cursor = connection.cursor()
-        cursor.execute('''
-            DELETE FROM characters
-            WHERE guild_id = :guild_id AND character_name = :name
-        ''', {"guild_id": guild_id, "name": name})
-        connection.commit()
+        await delete_characters(guild_id, name)
+        character_cache.invalidate((guild_id, name))
+        name_index.remove_character(guild_id, name)
         await interaction.followup.send(f"Character '{name}' has been deleted.", ephemeral=True)
-        await db.export_characters(interaction, send_messages=False)
+        backup_scheduler.schedule(interaction.guild)
     except Exception as e:
         await interaction.followup.send(f"Failed to delete character due to an error: {str(e)}", ephemeral=True)
-    finally:
-        cursor.close()
-        connection.close()
 
 class ConfirmDeleteView(discord.ui.View):
     def __init__(self):
@@ -118,19 +147,11 @@ class ConfirmDeleteView(discord.ui.View):
     @discord.ui.button(label="Confirm", style=discord.ButtonStyle.danger, custom_id="confirm_delete_all_characters")
     async def confirm_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         guild_id = str(interaction.guild_id)
-        connection = db.create_oracle_connection()
-        cursor = connection.cursor()
-        cursor.execute('''
-            DELETE FROM characters
-            WHERE guild_id = :guild_id
-        ''', {"guild_id": guild_id})
-        connection.commit()
-        cursor.close()
-        connection.close()
-        # send empty json to backup channel, but leave older messages for recovery
-        private_channel = discord.utils.get(interaction.guild.text_channels, name=BACKUP_CHANNEL)
-        if private_channel:
-            await db.export_json_to_channel(private_channel, {})
+        await delete_characters(guild_id)
+        character_cache.invalidate_prefix(guild_id)
+        name_index.invalidate(guild_id)
+        # back up the now empty guild, but leave older messages for recovery
+        backup_scheduler.schedule(interaction.guild)
         await interaction.response.send_message("All characters have been deleted from this guild.", ephemeral=True)
         self.stop()
 
@@ -151,10 +172,11 @@ async def delete_all_characters(interaction: discord.Interaction):
     image_url="Image URL for the character (optional)",
     background="New description for the character (optional)"
 )
+@app_commands.autocomplete(name=character_autocomplete)
 async def edit_character(interaction: discord.Interaction, name: str, new_name: str = None, image_url: str = None, background: str = None):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    character = get_character(guild_id, name)
+    character = await get_character(guild_id, name)
     if not character:
         await interaction.followup.send(f"Character '{name}' does not exist in this guild.", ephemeral=True)
         return
@@ -168,12 +190,9 @@ async def edit_character(interaction: discord.Interaction, name: str, new_name:
         character['background'] = background
     if new_name:
         character['name'] = new_name
-        name = new_name
 
     try:
-        connection = db.create_oracle_connection()
-        cursor = connection.cursor()
-        cursor.execute('''
+        await db.execute('''
             UPDATE characters
             SET character_name = :new_name, image_url = :image_url, background = :background
             WHERE guild_id = :guild_id AND character_name = :name
@@ -184,20 +203,21 @@ async def edit_character(interaction: discord.Interaction, name: str, new_name:
             "guild_id": guild_id, 
             "name": name
         })
-        connection.commit()
-        await interaction.followup.send(f"Character '{name}' has been updated.", ephemeral=True)
-        await db.export_characters(interaction, send_messages=False)
+        character_cache.invalidate((guild_id, name))
+        character_cache.invalidate((guild_id, character['name']))
+        if character['name'] != name:
+            name_index.rename_character(guild_id, name, character['name'])
+        await interaction.followup.send(f"Character '{character['name']}' has been updated.", ephemeral=True)
+        backup_scheduler.schedule(interaction.guild)
     except Exception as e:
         await interaction.followup.send(f"Failed to update character due to an error: {str(e)}", ephemeral=True)
-    finally:
-        cursor.close()
-        connection.close()
 
 @app_commands.command(name='allow_character', description="Allow another user to use a character in this guild.")
+@app_commands.autocomplete(character_name=character_autocomplete)
 async def allow_character(interaction: discord.Interaction, character_name: str, user: discord.User):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    character = get_character(guild_id, character_name)
+    character = await get_character(guild_id, character_name)
     
     if not character:
         await interaction.followup.send(f"Character '{character_name}' does not exist in this guild.", ephemeral=True)
@@ -206,34 +226,23 @@ async def allow_character(interaction: discord.Interaction, character_name: str,
     if not await owner_check(interaction, character):
         return
     
-    character['allowed_users'].append(str(user.id))
     try:
-        connection = db.create_oracle_connection()
-        cursor = connection.cursor()
-        cursor.execute('''
-            UPDATE characters
-            SET allowed_users = :allowed_users
-            WHERE guild_id = :guild_id AND character_name = :name
-        ''', {
-            "allowed_users": json.dumps(character['allowed_users']), 
-            "guild_id": guild_id, 
-            "name": character_name
-        })
-        connection.commit()
+        await db.transaction(db.backend.allow_user, character['id'], str(user.id))
+        # bump the generation first, so a lookup that read "not allowed" before the grant can't store it afterwards
+        permission_cache.invalidate((character['id'], str(user.id)))
+        permission_cache.set((character['id'], str(user.id)), True)
         await interaction.followup.send(f"User {user.name} can now use the character '{character_name}' in this guild.", ephemeral=True)
-        await db.export_characters(interaction, send_messages=False)
+        backup_scheduler.schedule(interaction.guild)
     except Exception as e:
         await interaction.followup.send(f"Failed to allow user due to an error: {str(e)}", ephemeral=True)
         return
-    finally:
-        cursor.close()
-        connection.close()
 
 @app_commands.command(name='view_character', description="View a character's information.")
+@app_commands.autocomplete(character_name=character_autocomplete)
 async def view_character(interaction: discord.Interaction, character_name: str):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    character = get_character(guild_id, character_name)
+    character = await get_character(guild_id, character_name)
     
     if not character:
         await interaction.followup.send(f"Character '{character_name}' does not exist in this guild.", ephemeral=True)
@@ -242,6 +251,7 @@ async def view_character(interaction: discord.Interaction, character_name: str):
     if not await allowed_users_check(interaction, character):
         return
     
+    character['allowed_users'] = await get_allowed_users(character['id'])
     channel = interaction.channel
     await db.export_json_to_channel(channel, {character_name: character})
     msg = await interaction.followup.send('Success!', ephemeral=True)
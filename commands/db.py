@@ -1,23 +1,129 @@
 import discord
 from discord import app_commands
+import asyncio
+import contextvars
+import functools
+import gzip
+import io
 import json
 import os
-import oracledb
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from . import storage
+from .cache import character_cache, permission_cache
+from .name_index import name_index
+from .guild_config import guild_config, BACKUP_CHANNEL
+from .metrics import metrics
 
-BACKUP_CHANNEL = 'npc-character-backup'
+BACKUP_FILENAME = 'characters.json'
+# gzip snapshots bigger than this many bytes
+BACKUP_COMPRESS_THRESHOLD = int(os.environ.get('BACKUP_COMPRESS_THRESHOLD', 1024 * 1024))
+# snapshots over the attachment limit are sent as several messages with files named like characters.json.gz.part2of3
+BACKUP_PART_PATTERN = re.compile(r'\.part(\d+)of(\d+)$')
+# Discord's upload limit for servers without boosts
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+# rows sent per executemany round trip when importing a backup
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+# Backup format version. Version 1 was a bare {character name: character} object without inventories,
+# version 2 wraps it as {"version": 2, "characters": {...}} and gives every character an "inventory" list.
+SNAPSHOT_VERSION = 2
 
-def create_oracle_connection():
-    connection = oracledb.connect(
-        user=os.environ.get('ORACLE_USER'),
-        password=os.environ.get('ORACLE_PASSWORD'),
-        dsn=os.environ.get('ORACLE_DSN'),
-    )
+# The storage backend picked by STORAGE_BACKEND, see commands/storage
+backend = storage.backend
+
+# open the backend's connections: the Oracle session pool, or the SQLite database file
+def create_pool():
+    backend.start()
+
+def close_pool():
+    backend.stop()
+
+# borrow a connection from the backend; connection.close() hands it back
+def connect():
+    start = time.perf_counter()
+    connection = backend.connect()
+    metrics.record_acquire(time.perf_counter() - start)
     return connection
 
-async def create_backup_channel(guild: discord.Guild):
-    if discord.utils.get(guild.text_channels, name=BACKUP_CHANNEL):
-        return
+# the migrations written for Oracle take their sessions from here
+create_oracle_connection = connect
+
+def migrate():
+    backend.migrate()
+
+# database calls block, so commands run them on this executor instead of the event loop
+_executor = ThreadPoolExecutor(max_workers=backend.WORKERS, thread_name_prefix='npc-db')
+
+# Runs in the current context so the query is counted against the interaction that made it
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, context.run, functools.partial(_timed, func, args, kwargs))
+
+def _timed(func, args, kwargs):
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        metrics.record_query(_query_label(func, args), time.perf_counter() - start)
+
+# the statement for plain queries, the function name for transactions and other database work
+def _query_label(func, args):
+    if func is _query:
+        return ' '.join(args[0].split())[:60]
+    if func is _transaction:
+        return args[0].__name__
+    return func.__name__
+
+def _query(sql, params, fetch):
+    connection = connect()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, params or {})
+        if fetch == 'one':
+            result = cursor.fetchone()
+        elif fetch == 'all':
+            result = cursor.fetchall()
+        else:
+            result = cursor.rowcount
+            connection.commit()
+        cursor.close()
+        return result
+    finally:
+        connection.close()
+
+def _transaction(func, args):
+    connection = connect()
+    try:
+        backend.begin(connection)
+        cursor = connection.cursor()
+        result = func(cursor, *args)
+        connection.commit()
+        cursor.close()
+        return result
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+# run a DML statement and commit it, returning the number of affected rows
+async def execute(sql, params=None):
+    return await run(_query, sql, params, None)
 
+async def fetchone(sql, params=None):
+    return await run(_query, sql, params, 'one')
+
+async def fetchall(sql, params=None):
+    return await run(_query, sql, params, 'all')
+
+# run func(cursor, *args) on one session and commit it as a single transaction, rolling back if it raises
+async def transaction(func, *args):
+    return await run(_transaction, func, args)
+
+async def create_backup_channel(guild: discord.Guild):
     overwrites = {
         guild.default_role: discord.PermissionOverwrite(read_messages=False),
         guild.me: discord.PermissionOverwrite(
@@ -28,12 +134,14 @@ async def create_backup_channel(guild: discord.Guild):
     }
     channel = await guild.create_text_channel(BACKUP_CHANNEL, overwrites=overwrites)
     await channel.edit(topic="NPC-generated channel for storing character data backups.")
+    await guild_config.set_channel(guild, 'backup', channel)
+    return channel
 
 
 @app_commands.command(name="init", description="Init or refresh the character data from the backup channel")
 async def init(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
-    private_channel = discord.utils.get(interaction.guild.text_channels, name=BACKUP_CHANNEL)
+    private_channel = await guild_config.channel(interaction.guild, 'backup')
     if private_channel:
         # Fetch the last message from the private channel
         messages = [message async for message in private_channel.history(limit=1)]
@@ -57,7 +165,7 @@ async def load_characters_from_message(interaction: discord.Interaction, message
     await interaction.response.defer()
     try:
         message = await channel.fetch_message(int(message_id))
-        load_character_data(interaction, message)  
+        await load_character_data(interaction, message)
     except Exception as e:
         await interaction.followup.send(f"Failed to load characters: {str(e)}", ephemeral=True)
 
@@ -66,39 +174,164 @@ async def load_character_data(interaction: discord.Interaction, message: discord
         await interaction.followup.send("No file attachments found in the message.", ephemeral=True)
         return
 
-    # Assuming there's only one attachment
-    attachment = message.attachments[0]
+    try:
+        file = await read_backup(message)
+    except (ValueError, OSError) as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
 
-    file = await attachment.read()
     try:
-        characters_data = json.loads(file.decode('utf-8'))
+        characters_data = snapshot_characters(json.loads(file.decode('utf-8')))
     except json.JSONDecodeError:
         await interaction.followup.send("The file content is not valid JSON.", ephemeral=True)
         return
+    except ValueError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
 
     guild_id = str(interaction.guild.id)
     try:
-        connection = create_oracle_connection()
-        cursor = connection.cursor()
-        for character_name, character_info in characters_data.items():        
-            cursor.execute('''
-                INSERT INTO characters (guild_id, character_name, owner_id, image_url, background, allowed_users)
-                VALUES (:guild_id, :name, :owner_id, :image_url, :background, :allowed_users)
-            ''', {
-                'guild_id': guild_id,
-                'name': character_name,
-                'owner_id': character_info['owner_id'],
-                'image_url': character_info.get('image_url', ''),
-                'background': character_info.get('background', ''),
-                'allowed_users': json.dumps(character_info.get('allowed_users', []))
-            })
-        connection.commit()
-        await interaction.followup.send(f"Characters loaded successfully from message.", ephemeral=True)
+        report = await transaction(import_characters, guild_id, characters_data)
+        character_cache.invalidate_prefix(guild_id)
+        permission_cache.clear()
+        name_index.invalidate(guild_id)
+        await interaction.followup.send(
+            f"Characters loaded successfully from message: {report['inserted']} added, {report['updated']} updated, {report['skipped']} skipped. "
+            f"Restored the inventory of {report['inventories']} characters ({report['items']} items).",
+            ephemeral=True
+        )
     except Exception as e:
         await interaction.followup.send(f"Failed to load characters: {str(e)}", ephemeral=True)
-    finally:
-        cursor.close()
-        connection.close()
+
+# the characters of any backup version, keyed by name
+def snapshot_characters(data):
+    if not isinstance(data, dict):
+        raise ValueError("The backup should be a JSON object.")
+    if not isinstance(data.get('version'), int):
+        return data
+    if data['version'] > SNAPSHOT_VERSION:
+        raise ValueError(f"This backup was made by a newer version of the bot (format {data['version']}), please update the bot first.")
+    return data.get('characters', {})
+
+INVENTORY_COLUMNS = ['name', 'quantity', 'info', 'price', 'discount', 'discount_threshold']
+
+# inventory item as a comparable tuple, with the /add_inventory defaults for missing fields
+def normalise_item(item):
+    return (
+        str(item['name']),
+        int(item.get('quantity') or 0),
+        item.get('info') or None,
+        int(item.get('price') if item.get('price') is not None else 1),
+        int(item.get('discount') or 0),
+        int(item.get('discount_threshold') or 0)
+    )
+
+GUILD_PERMISSIONS_SQL = '''
+    SELECT c.character_name, p.user_id
+    FROM characters c JOIN character_permissions p ON p.character_id = c.id
+    WHERE c.guild_id = :guild_id
+    ORDER BY c.character_name, p.user_id
+'''
+
+GUILD_INVENTORY_SQL = '''
+    SELECT c.character_name, i.id, i.name, i.quantity, i.info, i.price, i.discount, i.discount_threshold
+    FROM characters c JOIN inventory i ON i.character_id = c.id
+    WHERE c.guild_id = :guild_id
+    ORDER BY c.character_name, i.id
+'''
+
+def import_characters(cursor, guild_id, characters_data, batch_size=IMPORT_BATCH_SIZE):
+    cursor.execute('''
+        SELECT character_name, owner_id, image_url, background
+        FROM characters
+        WHERE guild_id = :guild_id
+    ''', {'guild_id': guild_id})
+    existing = {row[0]: row[1:] for row in cursor}
+    cursor.execute(GUILD_PERMISSIONS_SQL, {'guild_id': guild_id})
+    existing_users = {}
+    for character_name, user_id in cursor:
+        existing_users.setdefault(character_name, set()).add(user_id)
+    cursor.execute(GUILD_INVENTORY_SQL, {'guild_id': guild_id})
+    existing_items = {}
+    for row in cursor:
+        existing_items.setdefault(row[0], []).append(normalise_item(dict(zip(INVENTORY_COLUMNS, row[2:]))))
+
+    report = {'inserted': 0, 'updated': 0, 'skipped': 0, 'inventories': 0, 'items': 0}
+    rows = []
+    allowed_users = {}
+    inventories = {}
+    for character_name, character_info in characters_data.items():
+        if not isinstance(character_info, dict) or not character_info.get('owner_id'):
+            report['skipped'] += 1
+            continue
+
+        # version 1 backups have no inventories, leave the current ones alone
+        if isinstance(character_info.get('inventory'), list):
+            items = [normalise_item(item) for item in character_info['inventory']]
+            if sorted(items) != sorted(existing_items.get(character_name, [])):
+                inventories[character_name] = items
+
+        # Oracle stores empty strings as NULL, normalise so unchanged rows compare equal
+        values = (
+            str(character_info['owner_id']),
+            character_info.get('image_url') or None,
+            character_info.get('background') or None
+        )
+        users = {str(user_id) for user_id in character_info.get('allowed_users', [])}
+        if character_name not in existing:
+            report['inserted'] += 1
+        elif existing[character_name] != values or existing_users.get(character_name, set()) != users:
+            report['updated'] += 1
+        else:
+            report['skipped'] += 1
+            continue
+
+        allowed_users[character_name] = users
+        rows.append({
+            'guild_id': guild_id,
+            'character_name': character_name,
+            'owner_id': values[0],
+            'image_url': values[1],
+            'background': values[2]
+        })
+
+    # upsert on (guild_id, character_name), so loading the same backup twice doesn't duplicate characters
+    for start in range(0, len(rows), batch_size):
+        backend.merge_characters(cursor, rows[start:start + batch_size])
+
+    if not allowed_users and not inventories:
+        return report
+
+    # Backups refer to characters by name, so look up the ids they have in this database (new ones for inserted characters)
+    cursor.execute("SELECT character_name, id FROM characters WHERE guild_id = :guild_id", {'guild_id': guild_id})
+    ids = {character_name: character_id for character_name, character_id in cursor}
+
+    # replace the permissions of every inserted or updated character
+    if allowed_users:
+        deletes = [{'character_id': ids[character_name]} for character_name in allowed_users]
+        inserts = [
+            {'character_id': ids[character_name], 'user_id': user_id}
+            for character_name, users in allowed_users.items() for user_id in users
+        ]
+        for start in range(0, len(deletes), batch_size):
+            cursor.executemany("DELETE FROM character_permissions WHERE character_id = :character_id", deletes[start:start + batch_size])
+        for start in range(0, len(inserts), batch_size):
+            cursor.executemany("INSERT INTO character_permissions (character_id, user_id) VALUES (:character_id, :user_id)", inserts[start:start + batch_size])
+
+    # replace the inventory of every character whose items differ from the backup
+    if inventories:
+        deletes = [{'character_id': ids[character_name]} for character_name in inventories]
+        inserts = [
+            {'character_id': ids[character_name], **dict(zip(INVENTORY_COLUMNS, item))}
+            for character_name, items in inventories.items() for item in items
+        ]
+        for start in range(0, len(deletes), batch_size):
+            cursor.executemany("DELETE FROM inventory WHERE character_id = :character_id", deletes[start:start + batch_size])
+        for start in range(0, len(inserts), batch_size):
+            backend.insert_items(cursor, inserts[start:start + batch_size])
+        report['inventories'] = len(inventories)
+        report['items'] = len(inserts)
+    return report
  
 @app_commands.command(name="export_characters_manual", description="Export the list of characters as JSON to the back up channel")
 async def export_characters_manual(interaction: discord.Interaction):
@@ -106,47 +339,113 @@ async def export_characters_manual(interaction: discord.Interaction):
     await export_characters(interaction)
 
 async def export_characters(interaction: discord.Interaction):
-    guild_id = str(interaction.guild_id)
-    
-    connection = create_oracle_connection()
-    cursor = connection.cursor()
-    
-    cursor.execute('''
-        SELECT character_name, owner_id, image_url, background, allowed_users
-        FROM characters
-        WHERE guild_id = :guild_id
-    ''', {"guild_id": guild_id})
-    
-    characters = cursor.fetchall()
-    
-    if not characters or len(characters) == 0:
-        await interaction.response.send_message("No characters to export.", ephemeral=True)
-        cursor.close()
-        connection.close()
+    snapshot = await get_guild_snapshot(str(interaction.guild_id))
+    if not snapshot['characters']:
+        await interaction.followup.send("No characters to export.", ephemeral=True)
         return
 
-    characters_data = {}
-    for character in characters:
-        character_name, owner_id, image_url, background, allowed_users = character
-        characters_data[character_name] = {
-            "owner_id": owner_id,
-            "image_url": image_url,
-            "background": background,
-            "allowed_users": json.loads(allowed_users.read())
-        }
-    cursor.close()
-    connection.close()
-
-    private_channel = discord.utils.get(interaction.guild.text_channels, name=BACKUP_CHANNEL)
-    if private_channel:
-        await export_json_to_channel(private_channel, characters_data)
+    if await export_guild(interaction.guild, snapshot):
         await interaction.followup.send("Characters exported successfully.", ephemeral=True)
     else:
         await interaction.followup.send("Backup channel not found. Please run /init", ephemeral=True)
 
+# Read a guild's characters, permissions and inventories on one session.
+# Inventories come from a single join streamed in large batches rather than a query per character.
+def read_guild_snapshot(guild_id):
+    connection = connect()
+    try:
+        cursor = connection.cursor()
+        cursor.arraysize = 1000
+        cursor.execute('''
+            SELECT character_name, owner_id, image_url, background
+            FROM characters
+            WHERE guild_id = :guild_id
+            ORDER BY character_name
+        ''', {"guild_id": guild_id})
+        characters_data = {}
+        for character_name, owner_id, image_url, background in cursor:
+            characters_data[character_name] = {
+                "owner_id": owner_id,
+                "image_url": image_url,
+                "background": background,
+                "allowed_users": [],
+                "inventory": []
+            }
+
+        cursor.execute(GUILD_PERMISSIONS_SQL, {"guild_id": guild_id})
+        for character_name, user_id in cursor:
+            characters_data[character_name]["allowed_users"].append(user_id)
+
+        cursor.execute(GUILD_INVENTORY_SQL, {"guild_id": guild_id})
+        for row in cursor:
+            characters_data[row[0]]["inventory"].append(dict(zip(INVENTORY_COLUMNS, row[2:])))
+        cursor.close()
+    finally:
+        connection.close()
+    return {"version": SNAPSHOT_VERSION, "guild_id": guild_id, "characters": characters_data}
+
+async def get_guild_snapshot(guild_id):
+    return await run(read_guild_snapshot, guild_id)
+
+# upload a snapshot of the guild's characters and inventories to its backup channel, returns False if the guild never had one
+async def export_guild(guild: discord.Guild, snapshot=None):
+    private_channel = await guild_config.channel(guild, 'backup')
+    if not private_channel:
+        # the backup channel was deleted, make a new one rather than dropping backups. Guilds that never ran /init get none
+        if not await guild_config.has_channel(guild, 'backup'):
+            return False
+        private_channel = await create_backup_channel(guild)
+    if snapshot is None:
+        snapshot = await get_guild_snapshot(str(guild.id))
+    await export_json_to_channel(private_channel, snapshot)
+    return True
+
+# read the backup attached to message, joining the earlier parts of a split backup and undoing gzip
+async def read_backup(message: discord.Message):
+    # Assuming there's only one attachment
+    attachment = message.attachments[0]
+    part = BACKUP_PART_PATTERN.search(attachment.filename)
+    if not part:
+        return decompress_backup(await attachment.read())
+
+    index, total = int(part.group(1)), int(part.group(2))
+    if index != total:
+        raise ValueError(f"This message holds part {index} of {total} of a backup, please use the message with the last part.")
+    # the parts were sent as consecutive messages, ending with this one
+    parts = [attachment]
+    async for earlier in message.channel.history(limit=total - 1, before=message):
+        if not earlier.attachments or not earlier.attachments[0].filename.endswith(f'.part{total - len(parts)}of{total}'):
+            raise ValueError("Could not find every part of this backup in the channel.")
+        parts.append(earlier.attachments[0])
+    if len(parts) != total:
+        raise ValueError("Could not find every part of this backup in the channel.")
+    chunks = [await part.read() for part in reversed(parts)]
+    return decompress_backup(b''.join(chunks))
+
+def decompress_backup(file):
+    if file[:2] == b'\x1f\x8b':
+        try:
+            return gzip.decompress(file)
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            raise ValueError("The backup file is corrupt.")
+    return file
+
+def serialize_backup(data):
+    file = json.dumps(data, indent=4).encode('utf-8')
+    if len(file) > BACKUP_COMPRESS_THRESHOLD:
+        return gzip.compress(file), BACKUP_FILENAME + '.gz'
+    return file, BACKUP_FILENAME
+
 async def export_json_to_channel(channel, data):
-    with open("characters.json", "w") as f:
-        json.dump(data, f, indent=4)
+    # serialize and compress off the event loop, big guilds can take a while
+    file, filename = await asyncio.to_thread(serialize_backup, data)
+    limit = channel.guild.filesize_limit if getattr(channel, 'guild', None) else DEFAULT_UPLOAD_LIMIT
+
+    if len(file) <= limit:
+        await channel.send(file=discord.File(io.BytesIO(file), filename=filename))
+        return
 
-    await channel.send(file=discord.File("characters.json"))
-    os.remove("characters.json")
+    total = -(-len(file) // limit)
+    for index in range(total):
+        chunk = file[index * limit:(index + 1) * limit]
+        await channel.send(file=discord.File(io.BytesIO(chunk), filename=f'{filename}.part{index + 1}of{total}'))
@@ -0,0 +1,76 @@
+import discord
+from discord import app_commands
+from . import db
+
+BACKUP_CHANNEL = 'npc-character-backup'
+TRANSACTION_CHANNEL = 'npc-transactions'
+# setting -> (guild_config column, name of the channel the bot creates for it, when it creates it)
+CHANNEL_SETTINGS = {
+    'backup': ('backup_channel_id', BACKUP_CHANNEL, "by /init"),
+    'transactions': ('transaction_channel_id', TRANSACTION_CHANNEL, "with the first purchase"),
+}
+
+# The channels each guild uses, by ID, kept in memory after a guild's first lookup so finding one is a
+# guild.get_channel call rather than a search through every channel by name, and renaming it changes nothing.
+# Guilds whose channels were created before IDs were stored are matched by name once and the ID saved.
+# Only touched from the event loop, so it needs no locking.
+class GuildConfig:
+    def __init__(self):
+        self._configs = {}
+        # (guild_id, setting) searched by name without a match, not searched again until the setting is saved
+        self._searched = set()
+
+    async def get(self, guild_id):
+        config = self._configs.get(guild_id)
+        if config is None:
+            columns = [column for column, _, _ in CHANNEL_SETTINGS.values()]
+            row = await db.fetchone(f"SELECT {', '.join(columns)} FROM guild_config WHERE guild_id = :guild_id", {'guild_id': guild_id})
+            config = self._configs.setdefault(guild_id, dict(zip(CHANNEL_SETTINGS, row or [None] * len(columns))))
+        return config
+
+    # whether the guild has ever had a channel for setting, so a missing one was deleted rather than never made
+    async def has_channel(self, guild: discord.Guild, setting):
+        return (await self.get(str(guild.id)))[setting] is not None
+
+    # the guild's channel for setting, or None if it doesn't have one (anymore)
+    async def channel(self, guild: discord.Guild, setting):
+        guild_id = str(guild.id)
+        channel_id = (await self.get(guild_id))[setting]
+        if channel_id is not None:
+            channel = guild.get_channel(int(channel_id))
+            if channel is not None:
+                return channel
+        if (guild_id, setting) in self._searched:
+            return None
+        channel = discord.utils.get(guild.text_channels, name=CHANNEL_SETTINGS[setting][1])
+        if channel is None:
+            self._searched.add((guild_id, setting))
+        else:
+            await self.set_channel(guild, setting, channel)
+        return channel
+
+    async def set_channel(self, guild: discord.Guild, setting, channel: discord.abc.GuildChannel):
+        guild_id = str(guild.id)
+        await db.transaction(db.backend.save_guild_setting, guild_id, CHANNEL_SETTINGS[setting][0], str(channel.id))
+        (await self.get(guild_id))[setting] = str(channel.id)
+        self._searched.discard((guild_id, setting))
+
+guild_config = GuildConfig()
+
+@app_commands.command(name="npc_config", description="Show or change the channels the bot uses in this server")
+@app_commands.describe(
+    backup_channel="Channel for character backups, read by /init",
+    transaction_channel="Channel for purchase receipts",
+)
+@app_commands.default_permissions(administrator=True)
+async def npc_config(interaction: discord.Interaction, backup_channel: discord.TextChannel = None, transaction_channel: discord.TextChannel = None):
+    await interaction.response.defer(ephemeral=True)
+    for setting, channel in (('backup', backup_channel), ('transactions', transaction_channel)):
+        if channel is not None:
+            await guild_config.set_channel(interaction.guild, setting, channel)
+
+    lines = []
+    for setting, (_, name, created) in CHANNEL_SETTINGS.items():
+        channel = await guild_config.channel(interaction.guild, setting)
+        lines.append(f"{setting.capitalize()} channel: " + (channel.mention if channel else f"none, `#{name}` is created {created}"))
+    await interaction.followup.send("\n".join(lines), ephemeral=True)
@@ -0,0 +1,201 @@
+import discord
+from discord import app_commands
+import csv
+import io
+import json
+import re
+from . import db
+from . import character as char_commands
+from .backup import backup_scheduler
+from .name_index import name_index, character_autocomplete
+
+INVENTORY_FIELDS = ['name', 'quantity', 'info', 'price', 'discount', 'discount_threshold']
+NUMBER_FIELDS = ['quantity', 'price', 'discount', 'discount_threshold']
+MAX_IMPORT_BYTES = 1024 * 1024
+# reply inline while the per-row summary fits in a message, attach it as a file otherwise
+MAX_SUMMARY_LENGTH = 1800
+
+def parse_inventory_file(filename, content):
+    text = content.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        data = json.loads(text)
+        # either a list of items or the {name: {fields}} shape of character backups
+        if isinstance(data, dict):
+            for name, fields in data.items():
+                if not isinstance(fields, dict):
+                    raise ValueError(f"Item `{name}` should be an object with the item's fields.")
+            data = [{**fields, 'name': name} for name, fields in data.items()]
+        if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+            raise ValueError("JSON files must contain a list of items.")
+        return data
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or 'name' not in reader.fieldnames:
+        raise ValueError(f"CSV files need a header row with at least a `name` column. Supported columns: {', '.join(INVENTORY_FIELDS)}.")
+    return list(reader)
+
+# check one parsed row and convert it to bind values, returns (item, error)
+def validate_item(row, seen):
+    name = str(row.get('name') or '').strip()
+    if not name:
+        return None, "missing name"
+    if len(name) > 100:
+        return None, "name is longer than 100 characters"
+    if name in seen:
+        return None, "item appears more than once in the file"
+    seen.add(name)
+
+    info = str(row.get('info') or '').strip()
+    item = {'name': name, 'info': info or None}
+    if item['info'] and len(item['info']) > 255:
+        return None, "info is longer than 255 characters"
+    for field in NUMBER_FIELDS:
+        value = row.get(field)
+        if value is None or str(value).strip() == '':
+            item[field] = None
+            continue
+        try:
+            item[field] = int(str(value).strip())
+        except ValueError:
+            return None, f"{field} must be a whole number"
+        if item[field] < 0:
+            return None, f"{field} can't be negative"
+    if item['discount'] is not None and item['discount'] > 100:
+        return None, "discount is a percentage and can't be over 100"
+    return item, None
+
+def apply_inventory_rows(cursor, character_id, items, mode):
+    cursor.execute("SELECT name FROM inventory WHERE character_id = :character_id", {'character_id': character_id})
+    existing = {row[0] for row in cursor}
+    # fields left empty keep their current value, or the /add_inventory default for new items
+    db.backend.upsert_items(cursor, [{**item, 'character_id': character_id} for item in items], mode)
+    return [('restocked' if mode == 'restock' else 'updated') if item['name'] in existing else 'added' for item in items]
+
+def read_inventory(character_id):
+    connection = db.connect()
+    try:
+        cursor = connection.cursor()
+        # stream rows in batches instead of one round trip per row
+        cursor.arraysize = 500
+        cursor.execute(
+            "SELECT name, quantity, info, price, discount, discount_threshold FROM inventory WHERE character_id = :character_id ORDER BY id",
+            {'character_id': character_id}
+        )
+        rows = [dict(zip(INVENTORY_FIELDS, row)) for row in cursor]
+        cursor.close()
+        return rows
+    finally:
+        connection.close()
+
+def summary_file(lines, filename):
+    return discord.File(io.BytesIO("\n".join(lines).encode('utf-8')), filename=filename)
+
+@app_commands.command(name="import_inventory", description="Add, edit or restock many items at once from a CSV or JSON file")
+@app_commands.describe(
+    character="The character whose inventory to update",
+    file="CSV or JSON file with the columns name, quantity, info, price, discount, discount_threshold",
+    mode="Update sets the quantity to the one in the file, restock adds it to the current stock",
+)
+@app_commands.choices(mode=[
+    app_commands.Choice(name="Update", value="update"),
+    app_commands.Choice(name="Restock", value="restock"),
+])
+@app_commands.autocomplete(character=character_autocomplete)
+async def import_inventory(interaction: discord.Interaction, character: str, file: discord.Attachment, mode: str = "update"):
+    await interaction.response.defer(ephemeral=True)
+    guild_id = str(interaction.guild_id)
+    ch = await char_commands.get_character(guild_id, character)
+    if not ch:
+        await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
+        return
+
+    if not await char_commands.allowed_users_check(interaction, ch):
+        return
+
+    if file.size > MAX_IMPORT_BYTES:
+        await interaction.followup.send("The file is too large, inventory files can be at most 1 MB.", ephemeral=True)
+        return
+
+    try:
+        rows = parse_inventory_file(file.filename, await file.read())
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        await interaction.followup.send(f"Could not read `{file.filename}`: {e}", ephemeral=True)
+        return
+    if not rows:
+        await interaction.followup.send(f"`{file.filename}` doesn't contain any items.", ephemeral=True)
+        return
+
+    items = []
+    errors = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        item, error = validate_item(row, seen)
+        if error:
+            errors.append(f"Row {number} ({row.get('name') or 'no name'}): {error}")
+        else:
+            items.append(item)
+
+    # all or nothing: a file with mistakes changes no items
+    if errors:
+        lines = [f"No items were changed, {len(errors)} of {len(rows)} rows have problems:"] + errors
+        message = "\n".join(lines)
+        if len(message) <= MAX_SUMMARY_LENGTH:
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.followup.send(lines[0], file=summary_file(lines, 'import_errors.txt'), ephemeral=True)
+        return
+
+    try:
+        results = await db.transaction(apply_inventory_rows, ch["id"], items, mode)
+    except Exception as e:
+        await interaction.followup.send(f"Failed to import inventory due to an error: {str(e)}", ephemeral=True)
+        return
+    for item in items:
+        name_index.add_item(guild_id, character, item['name'])
+    backup_scheduler.schedule(interaction.guild)
+
+    counts = {result: results.count(result) for result in set(results)}
+    header = f"Imported {len(items)} items into character `{character}`'s inventory: " + ", ".join(f"{count} {result}" for result, count in sorted(counts.items()))
+    lines = [header] + [f"{item['name']}: {result}" for item, result in zip(items, results)]
+    message = "\n".join(lines)
+    if len(message) <= MAX_SUMMARY_LENGTH:
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.followup.send(header, file=summary_file(lines, 'import_summary.txt'), ephemeral=True)
+
+@app_commands.command(name="export_inventory", description="Download a character's inventory as a CSV or JSON file")
+@app_commands.describe(
+    character="The character whose inventory to export",
+    format="File format, CSV by default",
+)
+@app_commands.choices(format=[
+    app_commands.Choice(name="CSV", value="csv"),
+    app_commands.Choice(name="JSON", value="json"),
+])
+@app_commands.autocomplete(character=character_autocomplete)
+async def export_inventory(interaction: discord.Interaction, character: str, format: str = "csv"):
+    await interaction.response.defer(ephemeral=True)
+    guild_id = str(interaction.guild_id)
+    ch = await char_commands.get_character(guild_id, character)
+    if not ch:
+        await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
+        return
+
+    if not await char_commands.allowed_users_check(interaction, ch):
+        return
+
+    items = await db.run(read_inventory, ch["id"])
+    if not items:
+        await interaction.followup.send(f"Character `{character}`'s inventory is empty.", ephemeral=True)
+        return
+
+    if format == 'json':
+        content = json.dumps(items, indent=4)
+    else:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=INVENTORY_FIELDS)
+        writer.writeheader()
+        writer.writerows(items)
+        content = buffer.getvalue()
+
+    file = discord.File(io.BytesIO(content.encode('utf-8')), filename=f"{re.sub(r'[^A-Za-z0-9_-]+', '_', character)}_inventory.{format}")
+    await interaction.followup.send(f"Character `{character}`'s inventory ({len(items)} items). Edit it and use /import_inventory to load it back.", file=file, ephemeral=True)
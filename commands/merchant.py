@@ -4,26 +4,27 @@ import random
 import math
 from . import db
 from . import character as char_commands
-
-TRANSACTION_CHANNEL = 'npc-transactions'
-
-async def create_transaction_channel(guild: discord.Guild):
-    if discord.utils.get(guild.text_channels, name=TRANSACTION_CHANNEL):
-        return
-
-    overwrites = {
-        guild.default_role: discord.PermissionOverwrite(read_messages=False),
-        guild.me: discord.PermissionOverwrite(read_messages=True)
-    }
-    channel = await guild.create_text_channel(TRANSACTION_CHANNEL, overwrites=overwrites)
-    await channel.edit(topic="NPC-generated channel for posting transaction data.")
-
-def get_inventory_item(character_id, item_name):
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM inventory WHERE character_id = :character_id AND name = :name", {'character_id': character_id, 'name': item_name})
-    result = cursor.fetchone()
-    cursor.close()
+from .backup import backup_scheduler
+from .metrics import metrics
+from .receipts import receipt_publisher, record_transaction
+from .name_index import name_index, character_autocomplete, item_autocomplete
+
+INVENTORY_PAGE_SIZE = 10
+# different items one /buy can hold
+MAX_CART_ITEMS = 10
+# item info is shortened in the list and lines are capped, so a full page always fits in one Discord message
+INVENTORY_INFO_LIMIT = 60
+INVENTORY_LINE_LIMIT = 180
+# sort option -> column, items with equal values are ordered by id
+INVENTORY_SORTS = {
+    'added': 'id',
+    'name': 'name',
+    'price': 'price',
+    'quantity': 'quantity',
+}
+
+async def get_inventory_item(character_id, item_name):
+    result = await db.fetchone("SELECT * FROM inventory WHERE character_id = :character_id AND name = :name", {'character_id': character_id, 'name': item_name})
     if result:
         result = {
             'id': result[0],
@@ -37,30 +38,147 @@ def get_inventory_item(character_id, item_name):
         }
     return result
 
-def get_all_inventory(character_id):
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM inventory WHERE character_id = :character_id ORDER BY id", {'character_id': character_id})
-    result = cursor.fetchall()
-    cursor.close()
-    return result
-
-# publish transaction to a transaction channel, for gameplay recordkeeping
-async def publish_transaction(interaction: discord.Interaction, character, item, quantity, price, got_discount):
-    transaction_channel = discord.utils.get(interaction.guild.text_channels, name=TRANSACTION_CHANNEL)
-    if not transaction_channel:
-        await create_transaction_channel(interaction.guild)
-        transaction_channel = discord.utils.get(interaction.guild.text_channels, name=TRANSACTION_CHANNEL)
-
-    if not transaction_channel:
-        await interaction.followup.send("Transaction channel couldn't be created, please try again.", ephemeral=True)
-        return
-    
-    receipt = f"Player `{interaction.user.name}` bought {quantity} of item `{item}` for {price} gold from {character}"
-    if got_discount:
-        receipt += " with a discount"
-    
-    await transaction_channel.send(receipt)
+# the named items of a character's inventory in one query, keyed by name
+async def get_inventory_items(character_id, item_names):
+    binds = {f'name{index}': name for index, name in enumerate(item_names)}
+    rows = await db.fetchall(
+        f"SELECT id, name, quantity, price, discount, discount_threshold FROM inventory WHERE character_id = :character_id AND name IN ({', '.join(':' + bind for bind in binds)})",
+        {'character_id': character_id, **binds}
+    )
+    return {row[1]: dict(zip(['id', 'name', 'quantity', 'price', 'discount', 'discount_threshold'], row)) for row in rows}
+
+# Parse "Potion:2, Rope, Torch:3" into [(item name, quantity)], a line without a quantity buys one.
+# Names may contain colons, only a whole number after the last one is read as the quantity.
+def parse_cart(text):
+    cart = {}
+    for entry in text.split(','):
+        name, _, quantity = entry.rpartition(':')
+        if not name or not quantity.strip().isdigit():
+            name, quantity = entry, '1'
+        name = name.strip()
+        if not name:
+            continue
+        if int(quantity) < 1:
+            raise ValueError(f"You have to buy at least one of item `{name}`.")
+        cart[name] = cart.get(name, 0) + int(quantity)
+    if not cart:
+        raise ValueError("List the items to buy as `item:quantity`, separated by commas.")
+    if len(cart) > MAX_CART_ITEMS:
+        raise ValueError(f"You can buy at most {MAX_CART_ITEMS} different items at once.")
+    return list(cart.items())
+
+# roll a d20 against the item's threshold, returns the unit price after the roll and whether it was discounted
+def roll_barter(item):
+    roll = random.randint(1, 20)
+    if roll >= item['discount_threshold'] or roll == 20:
+        # round up to nearest integer, don't deal w decimals in rpgs
+        return item['price'] - math.ceil(item['price'] * item['discount'] / 100), True
+    return item['price'], False
+
+# Take quantity out of stock only if enough is left, so concurrent buyers can't oversell.
+# Returns the remaining stock, or None if there wasn't enough.
+def purchase_item(cursor, item_id, quantity):
+    return db.backend.purchase_item(cursor, item_id, quantity)
+
+# A line of an order couldn't be taken out of stock, raised to roll back the lines already taken
+class OutOfStock(Exception):
+    def __init__(self, item_name):
+        super().__init__(item_name)
+        self.item_name = item_name
+
+# Take every line of an order out of stock and record it in the ledger in one transaction, so no sale goes without
+# a receipt and an order is bought in full or not at all. Items are taken in id order, so two orders sharing items
+# can't deadlock on each other's row locks. Returns the remaining stock per item.
+def record_order(cursor, sales):
+    remaining = {}
+    for sale in sorted(sales, key=lambda sale: sale['item_id']):
+        left = purchase_item(cursor, sale['item_id'], sale['quantity'])
+        if left is None:
+            raise OutOfStock(sale['item_name'])
+        record_transaction(cursor, sale)
+        remaining[sale['item_name']] = left
+    return remaining
+
+# One page of a character's inventory using keyset pagination: rows come after the (sort value, id) of the
+# previous page's last row, so a deep page doesn't read and skip the pages before it as an OFFSET would. Only the
+# name sort can follow an index, (character_id, name); the other sorts find the character's items through it and
+# sort them, which stays cheap at the size of one inventory.
+# Fetches one extra row to tell whether there is a next page.
+async def get_inventory_page(character_id, sort='added', search=None, after=None, limit=INVENTORY_PAGE_SIZE):
+    column = INVENTORY_SORTS[sort]
+    sql = f"SELECT id, name, quantity, info, price, discount, discount_threshold, {column} FROM inventory WHERE character_id = :character_id"
+    params = {'character_id': character_id, 'limit': limit + 1}
+    if search:
+        sql += " AND LOWER(name) LIKE :search ESCAPE '\\'"
+        escaped = search.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params['search'] = f"%{escaped}%"
+    if after:
+        if column == 'id':
+            sql += " AND id > :after_id"
+        else:
+            sql += f" AND ({column} > :after_value OR ({column} = :after_value AND id > :after_id))"
+            params['after_value'] = after[0]
+        params['after_id'] = after[1]
+    sql += f" ORDER BY {column}, id {db.backend.LIMIT_SQL}"
+    rows = await db.fetchall(sql, params)
+    return rows[:limit], len(rows) > limit
+
+def format_inventory_line(item, see_more):
+    line = f"{item[1]}: {item[2]}"
+    if item[3]:
+        info = item[3] if len(item[3]) <= INVENTORY_INFO_LIMIT else item[3][:INVENTORY_INFO_LIMIT - 1] + "…"
+        line += f"; {info}"
+    if see_more:
+        line += f"; {item[4]} gold"
+        if item[5] > 0:
+            line += f"; {item[5]}% discount at roll {item[6]}"
+    if len(line) > INVENTORY_LINE_LIMIT:
+        line = line[:INVENTORY_LINE_LIMIT - 1] + "…"
+    return line
+
+# Pages through an inventory with previous/next buttons, fetching one page per click
+class InventoryView(discord.ui.View):
+    def __init__(self, character, character_id, see_more, sort, search):
+        super().__init__(timeout=300)
+        self.character = character
+        self.character_id = character_id
+        self.see_more = see_more
+        self.sort = sort
+        self.search = search
+        # keyset position before each page visited so far, the last entry is the current page
+        self.positions = [None]
+        self.items = []
+        self.has_next = False
+        self.message = None
+
+    async def load(self):
+        self.items, self.has_next = await get_inventory_page(self.character_id, self.sort, self.search, self.positions[-1])
+        self.previous_page.disabled = len(self.positions) == 1
+        self.next_page.disabled = not self.has_next
+
+    def render(self):
+        title = f"Character `{self.character}`'s inventory"
+        if self.search:
+            title += f" matching `{self.search[:50]}`"
+        lines = "\n".join(format_inventory_line(item, self.see_more) for item in self.items)
+        return f"{title} (page {len(self.positions)}, sorted by {self.sort}):\n{lines}"
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.positions.pop()
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        last = self.items[-1]
+        self.positions.append((last[7], last[0]))
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    async def on_timeout(self):
+        if self.message:
+            await self.message.edit(view=None)
 
 @app_commands.command(name="add_inventory", description="Add an item to a character's inventory")
 @app_commands.describe(
@@ -72,10 +190,11 @@ async def publish_transaction(interaction: discord.Interaction, character, item,
     discount="The discount percentage for the item (default 0)",
     discount_threshold="The value players can roll to get a discount (default 0)"
 )
+@app_commands.autocomplete(character=character_autocomplete)
 async def add_inventory(interaction: discord.Interaction, character: str, item_name: str, quantity: int, info: str = None, price: int = 1, discount: int = 0, discount_threshold: int = 0):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    ch = char_commands.get_character(guild_id, character)
+    ch = await char_commands.get_character(guild_id, character)
     if not ch:
         await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
         return
@@ -83,15 +202,13 @@ async def add_inventory(interaction: discord.Interaction, character: str, item_n
     if not await char_commands.allowed_users_check(interaction, ch):
         return
     
-    if get_inventory_item(ch["id"], item_name):
+    if await get_inventory_item(ch["id"], item_name):
         await interaction.followup.send(f"Item `{item_name}` already exists in character `{character}`'s inventory.", ephemeral=True)
         return
 
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("INSERT INTO inventory (id, character_id, name, quantity, info, price, discount, discount_threshold) VALUES (inventory_seq.nextval, :character_id, :name, :quantity, :info, :price, :discount, :discount_threshold)", {'character_id': ch["id"], 'name': item_name, 'quantity': quantity, 'info': info, 'price': price, 'discount': discount, 'discount_threshold': discount_threshold})
-    connection.commit()
-    cursor.close()
+    await db.transaction(db.backend.insert_items, [{'character_id': ch["id"], 'name': item_name, 'quantity': quantity, 'info': info, 'price': price, 'discount': discount, 'discount_threshold': discount_threshold}])
+    name_index.add_item(guild_id, character, item_name)
+    backup_scheduler.schedule(interaction.guild)
 
     await interaction.followup.send(f"Item `{item_name}` added to character `{character}`'s inventory.", ephemeral=True)
 
@@ -106,10 +223,11 @@ async def add_inventory(interaction: discord.Interaction, character: str, item_n
     discount="The discount percentage for the item",
     discount_threshold="The value players can roll to get a discount"
 )
+@app_commands.autocomplete(character=character_autocomplete, item_name=item_autocomplete)
 async def edit_inventory(interaction: discord.Interaction, character: str, item_name: str, new_item_name: str = None, quantity: int = 0, info: str = None, price: int = 0, discount: int = 0, discount_threshold: int = 0):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    ch = char_commands.get_character(guild_id, character)
+    ch = await char_commands.get_character(guild_id, character)
     if not ch:
         await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
         return
@@ -117,11 +235,15 @@ async def edit_inventory(interaction: discord.Interaction, character: str, item_
     if not await char_commands.allowed_users_check(interaction, ch):
         return
     
-    item = get_inventory_item(ch["id"], item_name)
+    item = await get_inventory_item(ch["id"], item_name)
     if not item:
         await interaction.followup.send(f"Item `{item_name}` does not exist in character `{character}`'s inventory.", ephemeral=True)
         return
-    
+
+    if new_item_name and new_item_name != item_name and await get_inventory_item(ch["id"], new_item_name):
+        await interaction.followup.send(f"Item `{new_item_name}` already exists in character `{character}`'s inventory.", ephemeral=True)
+        return
+
     item['name'] = new_item_name if new_item_name else item['name']
     item['quantity'] = quantity if quantity else item['quantity']
     item['info'] = info if info else item['info']
@@ -129,11 +251,10 @@ async def edit_inventory(interaction: discord.Interaction, character: str, item_
     item['discount'] = discount if discount else item['discount']
     item['discount_threshold'] = discount_threshold if discount_threshold else item['discount_threshold']
 
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("UPDATE inventory SET name = :name, quantity = :quantity, info = :info, price = :price, discount = :discount, discount_threshold = :discount_threshold WHERE character_id = :character_id AND name = :old_name", {'name': item['name'], 'quantity': item['quantity'], 'info': item['info'], 'price': item['price'], 'discount': item['discount'], 'discount_threshold': item['discount_threshold'], 'character_id': ch["id"], 'old_name': item_name})
-    connection.commit()
-    cursor.close()
+    await db.execute("UPDATE inventory SET name = :name, quantity = :quantity, info = :info, price = :price, discount = :discount, discount_threshold = :discount_threshold WHERE character_id = :character_id AND name = :old_name", {'name': item['name'], 'quantity': item['quantity'], 'info': item['info'], 'price': item['price'], 'discount': item['discount'], 'discount_threshold': item['discount_threshold'], 'character_id': ch["id"], 'old_name': item_name})
+    if item['name'] != item_name:
+        name_index.rename_item(guild_id, character, item_name, item['name'])
+    backup_scheduler.schedule(interaction.guild)
 
     await interaction.followup.send(f"Item `{item_name}` edited in character `{character}`'s inventory.", ephemeral=True)
 
@@ -142,10 +263,11 @@ async def edit_inventory(interaction: discord.Interaction, character: str, item_
     character="The character to remove the item from",
     item_name="The name of the item",
 )
+@app_commands.autocomplete(character=character_autocomplete, item_name=item_autocomplete)
 async def remove_inventory(interaction: discord.Interaction, character: str, item_name: str):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    ch = char_commands.get_character(guild_id, character)
+    ch = await char_commands.get_character(guild_id, character)
     if not ch:
         await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
         return
@@ -153,15 +275,13 @@ async def remove_inventory(interaction: discord.Interaction, character: str, ite
     if not await char_commands.allowed_users_check(interaction, ch):
         return
     
-    if not get_inventory_item(ch["id"], item_name):
+    if not await get_inventory_item(ch["id"], item_name):
         await interaction.followup.send(f"Item `{item_name}` does not exist in character `{character}`'s inventory.", ephemeral=True)
         return
 
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("DELETE FROM inventory WHERE character_id = :character_id AND name = :name", {'character_id': ch["id"], 'name': item_name})
-    connection.commit()
-    cursor.close()
+    await db.execute("DELETE FROM inventory WHERE character_id = :character_id AND name = :name", {'character_id': ch["id"], 'name': item_name})
+    name_index.remove_item(guild_id, character, item_name)
+    backup_scheduler.schedule(interaction.guild)
 
     await interaction.followup.send(f"Item `{item_name}` removed from character `{character}`'s inventory.", ephemeral=True)
 
@@ -171,10 +291,11 @@ async def remove_inventory(interaction: discord.Interaction, character: str, ite
     item_name="The name of the item",
     quantity="The number of items to add",
 )
+@app_commands.autocomplete(character=character_autocomplete, item_name=item_autocomplete)
 async def add_stock(interaction: discord.Interaction, character: str, item_name: str, quantity: int):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    ch = char_commands.get_character(guild_id, character)
+    ch = await char_commands.get_character(guild_id, character)
     if not ch:
         await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
         return
@@ -182,50 +303,123 @@ async def add_stock(interaction: discord.Interaction, character: str, item_name:
     if not await char_commands.allowed_users_check(interaction, ch):
         return
     
-    item = get_inventory_item(ch["id"], item_name)
+    item = await get_inventory_item(ch["id"], item_name)
     if not item:
         await interaction.followup.send(f"Item `{item_name}` does not exist in character `{character}`'s inventory.", ephemeral=True)
         return
 
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("UPDATE inventory SET quantity = quantity + :quantity WHERE character_id = :character_id AND name = :name", {'quantity': quantity, 'character_id': ch["id"], 'name': item_name})
-    connection.commit()
-    cursor.close()
+    await db.execute("UPDATE inventory SET quantity = quantity + :quantity WHERE character_id = :character_id AND name = :name", {'quantity': quantity, 'character_id': ch["id"], 'name': item_name})
+    backup_scheduler.schedule(interaction.guild)
 
     await interaction.followup.send(f"Stock added to item `{item_name}` in character `{character}`'s inventory.", ephemeral=True)
 
 @app_commands.command(name="see_inventory", description="See a character's inventory")
 @app_commands.describe(
     character="The character to see the inventory of",
+    search="Only show items whose name contains this text",
+    sort="The order to list items in (default: the order they were added)",
 )
-async def see_inventory(interaction: discord.Interaction, character: str):
+@app_commands.autocomplete(character=character_autocomplete)
+@app_commands.choices(sort=[
+    app_commands.Choice(name="Order added", value="added"),
+    app_commands.Choice(name="Name", value="name"),
+    app_commands.Choice(name="Price", value="price"),
+    app_commands.Choice(name="Quantity", value="quantity"),
+])
+async def see_inventory(interaction: discord.Interaction, character: str, search: str = None, sort: str = "added"):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    ch = char_commands.get_character(guild_id, character)
+    ch = await char_commands.get_character(guild_id, character)
     if not ch:
         await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
         return
     
-    see_more = await char_commands.allowed_users_check(interaction, ch)
+    see_more = await char_commands.allowed_users_check(interaction, ch, send_followup=False)
+
+    view = InventoryView(character, ch["id"], see_more, sort, search)
+    await view.load()
+    if not view.items:
+        if search:
+            await interaction.followup.send(f"Character `{character}` has no items matching `{search}`.", ephemeral=True)
+        else:
+            await interaction.followup.send(f"Character `{character}`'s inventory is empty.", ephemeral=True)
+        return
 
-    items = get_all_inventory(ch["id"])
-    if not items:
-        await interaction.followup.send(f"Character `{character}`'s inventory is empty.", ephemeral=True)
+    if not view.has_next:
+        view.stop()
+        await interaction.followup.send(view.render(), ephemeral=True)
+        return
+    view.message = await interaction.followup.send(view.render(), view=view, ephemeral=True, wait=True)
+
+# Buy every (item name, quantity) line of the cart from a character, all or nothing. Stock is checked up front so the
+# buyer learns about every problem at once, and again when the order is taken out of stock after bartering.
+async def checkout(interaction: discord.Interaction, character, cart):
+    guild_id = str(interaction.guild_id)
+    ch = await char_commands.get_character(guild_id, character)
+    if not ch:
+        await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
         return
 
-    items_str = ""
-    for item in items:
-        items_str += f"{item[2]}: {item[3]}"
-        if item[4]:
-            items_str += f"; {item[4]}"
-        if see_more:
-            items_str += f"; {item[5]} gold"
-            if item[6] > 0:
-                items_str += f"; {item[6]}% discount at roll {item[7]}"
-        items_str += "\n"
+    items = await get_inventory_items(ch["id"], [item_name for item_name, _ in cart])
+    problems = []
+    for item_name, quantity in cart:
+        if item_name not in items:
+            problems.append(f"Item `{item_name}` does not exist in character `{character}`'s inventory.")
+        elif items[item_name]['quantity'] < quantity:
+            problems.append(f"Character `{character}` does not have enough stock of item `{item_name}`.")
+    if problems:
+        await interaction.followup.send("\n".join(problems), ephemeral=True)
+        return
 
-    await interaction.followup.send(f"Character `{character}`'s inventory:\n{items_str}", ephemeral=True)
+    prices = {item_name: (items[item_name]['price'], False) for item_name, _ in cart}
+    barterable = [item_name for item_name, _ in cart if items[item_name]['discount'] > 0]
+    if barterable:
+        view = BarterView()
+        prompt = "Would you like to roll to barter?" if len(cart) == 1 else f"Would you like to roll to barter for {', '.join(f'`{name}`' for name in barterable)}? Each item gets its own roll."
+        await interaction.followup.send(prompt, view=view, ephemeral=True)
+        # the buyer can take up to the view's timeout to decide, which shouldn't count as command latency
+        with metrics.user_wait(interaction):
+            await view.wait()
+        if view.result == 'barter':
+            results = []
+            for item_name in barterable:
+                price, got_discount = prices[item_name] = roll_barter(items[item_name])
+                if got_discount:
+                    results.append(f"Barter successful! Price reduced to {price}." if len(cart) == 1 else f"`{item_name}`: barter successful, price reduced to {price}.")
+                else:
+                    results.append(f"Barter failed! Price remains at {price}." if len(cart) == 1 else f"`{item_name}`: barter failed, price remains at {price}.")
+            await interaction.followup.send("\n".join(results), ephemeral=True)
+
+    sales = [{
+        'item_id': items[item_name]['id'],
+        'guild_id': guild_id,
+        'character_id': ch['id'],
+        'character_name': character,
+        'item_name': item_name,
+        'buyer_id': str(interaction.user.id),
+        'buyer_name': interaction.user.name,
+        'quantity': quantity,
+        'price': prices[item_name][0] * quantity,
+        'discounted': int(prices[item_name][1]),
+        'interaction_id': str(interaction.id),
+    } for item_name, quantity in cart]
+    # stock may have changed while the buyer was deciding whether to barter, so the purchase re-checks it
+    try:
+        remaining = await db.transaction(record_order, sales)
+    except OutOfStock as e:
+        await interaction.followup.send(f"Character `{character}` no longer has enough stock of item `{e.item_name}`." + (" Nothing was bought." if len(cart) > 1 else ""), ephemeral=True)
+        return
+    backup_scheduler.schedule(interaction.guild)
+    # the receipt is posted to the transactions channel in the guild's next batch
+    receipt_publisher.schedule(interaction.guild)
+
+    if len(cart) == 1:
+        item_name, _ = cart[0]
+        await interaction.followup.send(f"Item `{item_name}` bought from character `{character}`. {remaining[item_name]} left in stock.", ephemeral=True)
+    else:
+        lines = [f"Bought from character `{character}` for {sum(sale['price'] for sale in sales)} gold:"]
+        lines += [f"- {sale['quantity']} of item `{sale['item_name']}` for {sale['price']} gold, {remaining[sale['item_name']]} left in stock" for sale in sales]
+        await interaction.followup.send("\n".join(lines), ephemeral=True)
 
 @app_commands.command(name="buy_item", description="Buy an item from a character's inventory")
 @app_commands.describe(
@@ -233,49 +427,28 @@ async def see_inventory(interaction: discord.Interaction, character: str):
     item_name="The name of the item",
     quantity="The number of items to buy",
 )
+@app_commands.autocomplete(character=character_autocomplete, item_name=item_autocomplete)
 async def buy_item(interaction: discord.Interaction, character: str, item_name: str, quantity: int = 1):
     await interaction.response.defer(ephemeral=True)
-    guild_id = str(interaction.guild_id)
-    ch = char_commands.get_character(guild_id, character)
-    if not ch:
-        await interaction.followup.send(f"Character `{character}` does not exist.", ephemeral=True)
-        return
-    
-    item = get_inventory_item(ch["id"], item_name)
-    if not item:
-        await interaction.followup.send(f"Item `{item_name}` does not exist in character `{character}`'s inventory.", ephemeral=True)
-        return
-    
-    if item['quantity'] < quantity:
-        await interaction.followup.send(f"Character `{character}` does not have enough stock of item `{item_name}`.", ephemeral=True)
+    if quantity < 1:
+        await interaction.followup.send("You have to buy at least one item.", ephemeral=True)
         return
-    
-    price = item['price']
-    got_discount = False
+    await checkout(interaction, character, [(item_name, quantity)])
 
-    if item['discount'] > 0:
-        view = BarterView()
-        await interaction.followup.send("Would you like to roll to barter?", view=view, ephemeral=True)
-        await view.wait()
-        if view.result == 'barter':
-            # choose random number between 1 and 20
-            roll = random.randint(1, 20)
-            if roll >= item['discount_threshold'] or roll == 20:
-                # round up to nearest integer, don't deal w decimals in rpgs
-                price = price - math.ceil(price * item['discount'] / 100)
-                got_discount = True
-                await interaction.followup.send(f"Barter successful! Price reduced to {price}.", ephemeral=True)
-            else:
-                await interaction.followup.send(f"Barter failed! Price remains at {price}.", ephemeral=True)
-
-    connection = db.create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("UPDATE inventory SET quantity = quantity - :quantity WHERE character_id = :character_id AND name = :name", {'quantity': quantity, 'character_id': ch["id"], 'name': item_name})
-    connection.commit()
-    cursor.close()
-
-    await publish_transaction(interaction, character, item_name, quantity, price * quantity, got_discount)
-    await interaction.followup.send(f"Item `{item_name}` bought from character `{character}`.", ephemeral=True)
+@app_commands.command(name="buy", description="Buy several items from a character's inventory at once")
+@app_commands.describe(
+    character="The character to buy the items from",
+    items="The items to buy as item:quantity, separated by commas, e.g. Potion:2, Rope, Torch:3",
+)
+@app_commands.autocomplete(character=character_autocomplete)
+async def buy(interaction: discord.Interaction, character: str, items: str):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        cart = parse_cart(items)
+    except ValueError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
+    await checkout(interaction, character, cart)
 
 class BarterView(discord.ui.View):
     def __init__(self):
@@ -1,7 +1,25 @@
 import discord
 from discord import app_commands
 import aiohttp
+import os
 from . import character
+from . import db
+from .send_queue import WebhookSendQueue
+from .name_index import character_autocomplete
+
+WEBHOOK_NAME = "NpcCharacterWebhook"
+
+# one HTTP session for all webhook sends, so connections to Discord are kept alive between messages
+_session = None
+
+# channel id -> webhook url, backed by the webhooks table so it survives restarts
+_webhook_urls = {}
+webhook_stats = {
+    'memory_hits': 0,
+    'db_hits': 0,
+    'rest_lookups': 0,
+    'stale': 0,
+}
 
 async def get_or_create_webhook(channel: discord.TextChannel, name: str):
     webhooks = await channel.webhooks()
@@ -12,16 +30,62 @@ async def get_or_create_webhook(channel: discord.TextChannel, name: str):
     
     return webhook
 
-async def send_webhook_message(webhook: discord.Webhook, username: str, avatar_url: str, content: str):
-    async with aiohttp.ClientSession() as session:
-        webhook = discord.Webhook.from_url(webhook.url, session=session)
-        await webhook.send(content=content, username=username, avatar_url=avatar_url)
+async def get_webhook_url(channel: discord.TextChannel):
+    url = _webhook_urls.get(channel.id)
+    if url:
+        webhook_stats['memory_hits'] += 1
+        return url
+
+    row = await db.fetchone("SELECT webhook_url FROM webhooks WHERE channel_id = :channel_id", {'channel_id': str(channel.id)})
+    if row:
+        webhook_stats['db_hits'] += 1
+        _webhook_urls[channel.id] = row[0]
+        return row[0]
+
+    webhook_stats['rest_lookups'] += 1
+    webhook = await get_or_create_webhook(channel, WEBHOOK_NAME)
+    await db.transaction(db.backend.save_webhook, str(channel.id), str(channel.guild.id), webhook.url)
+    _webhook_urls[channel.id] = webhook.url
+    return webhook.url
+
+# drop a cached webhook that Discord no longer knows about
+async def forget_webhook(channel_id):
+    webhook_stats['stale'] += 1
+    _webhook_urls.pop(channel_id, None)
+    await db.execute("DELETE FROM webhooks WHERE channel_id = :channel_id", {'channel_id': str(channel_id)})
+
+# every cached lookup is one channel.webhooks() REST call saved
+def get_webhook_stats():
+    return {**webhook_stats, 'rest_calls_saved': webhook_stats['memory_hits'] + webhook_stats['db_hits']}
+
+async def open_session():
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.environ.get('WEBHOOK_CONNECTION_LIMIT', 20)),
+            keepalive_timeout=float(os.environ.get('WEBHOOK_KEEPALIVE_TIMEOUT', 60)),
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+send_queue = WebhookSendQueue(open_session)
+
+# queued behind earlier messages for the same webhook; returns once Discord has posted the message
+async def send_webhook_message(webhook_url: str, username: str, avatar_url: str, content: str):
+    return await send_queue.send(webhook_url, {'content': content, 'username': username, 'avatar_url': avatar_url})
 
 @app_commands.command(name="speak_as", description="Send a message as a character")
+@app_commands.autocomplete(character_name=character_autocomplete)
 async def speak_as_character(interaction: discord.Interaction, character_name: str, message: str):
     await interaction.response.defer(ephemeral=True)
     guild_id = str(interaction.guild_id)
-    ch = character.get_character(guild_id, character_name)
+    ch = await character.get_character(guild_id, character_name)
     if not ch:
         await interaction.followup.send(f"Character `{character_name}` does not exist.", ephemeral=True)
         return
@@ -30,13 +94,26 @@ async def speak_as_character(interaction: discord.Interaction, character_name: s
         return
 
     channel = interaction.channel
-    webhook = await get_or_create_webhook(channel, "NpcCharacterWebhook")
     try:
-        await send_webhook_message(webhook, character_name, ch["image_url"], message)
+        webhook_url = await get_webhook_url(channel)
+        try:
+            await send_webhook_message(webhook_url, character_name, ch["image_url"], message)
+        except discord.NotFound:
+            # the cached webhook was deleted, look it up again and retry once
+            await forget_webhook(channel.id)
+            webhook_url = await get_webhook_url(channel)
+            await send_webhook_message(webhook_url, character_name, ch["image_url"], message)
+    except discord.HTTPException as e:
+        print(e)
+        if e.status == 429:
+            await interaction.followup.send("Discord is rate limiting this channel, please try again in a moment.", ephemeral=True)
+        else:
+            await interaction.followup.send(f"Failed to send message: Discord returned an error ({e.status}). Please check your character settings.", ephemeral=True)
+        return
     except Exception as e:
         print(e)
         await interaction.followup.send("Failed to send message due to an error. Please check your character settings or try again later.", ephemeral=True)
         return
     
     msg = await interaction.followup.send('Success!', ephemeral=True)
-    await msg.delete(delay=2)
\ No newline at end of file
+    await msg.delete(delay=2)
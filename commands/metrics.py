@@ -0,0 +1,294 @@
+import asyncio
+import contextlib
+import contextvars
+import io
+import os
+import threading
+import time
+from collections import deque
+import discord
+from discord import app_commands
+from aiohttp import web
+from .cache import character_cache, permission_cache
+
+# commands slower than this many seconds are kept with their query breakdown
+SLOW_COMMAND_SECONDS = float(os.environ.get('SLOW_COMMAND_SECONDS', 2.0))
+SLOW_COMMAND_SAMPLES = int(os.environ.get('SLOW_COMMAND_SAMPLES', 20))
+# recent durations kept per command for percentiles in /npc_stats
+RECENT_SAMPLES = 500
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# seconds a command waits for start-up migrations before it is turned away, Discord wants an answer within 3
+SCHEMA_WAIT_SECONDS = 2.0
+
+# Database work done for one interaction. db.run copies the context into its worker threads,
+# so queries find the interaction they belong to through this variable.
+current_interaction = contextvars.ContextVar('current_interaction', default=None)
+
+class InteractionMetrics:
+    def __init__(self, command):
+        self.command = command
+        self.started = time.perf_counter()
+        self.queries = []
+        self.acquire_seconds = 0.0
+        # time spent waiting for the user, such as a barter prompt, which isn't the bot's latency
+        self.user_seconds = 0.0
+
+    @property
+    def db_seconds(self):
+        return sum(seconds for _, seconds in self.queries)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[index] += 1
+
+class CommandStats:
+    def __init__(self):
+        self.duration = Histogram()
+        self.errors = 0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+# Process-wide counters. Queries and pool acquires are recorded from db worker threads, hence the lock.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = {}
+        self.acquire = Histogram()
+        self.queries = Histogram()
+        self.slow = deque(maxlen=SLOW_COMMAND_SAMPLES)
+
+    def record_query(self, label, seconds):
+        with self._lock:
+            self.queries.observe(seconds)
+        interaction_metrics = current_interaction.get()
+        if interaction_metrics is not None:
+            interaction_metrics.queries.append((label, seconds))
+
+    def record_acquire(self, seconds):
+        with self._lock:
+            self.acquire.observe(seconds)
+        interaction_metrics = current_interaction.get()
+        if interaction_metrics is not None:
+            interaction_metrics.acquire_seconds += seconds
+
+    def command_started(self, interaction):
+        interaction_metrics = InteractionMetrics(interaction.command.qualified_name if interaction.command else 'unknown')
+        interaction.extras['metrics'] = interaction_metrics
+        current_interaction.set(interaction_metrics)
+
+    # leave the time spent in the block out of the interaction's duration
+    @contextlib.contextmanager
+    def user_wait(self, interaction):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            interaction_metrics = interaction.extras.get('metrics')
+            if interaction_metrics is not None:
+                interaction_metrics.user_seconds += time.perf_counter() - start
+
+    def command_finished(self, interaction, failed=False):
+        interaction_metrics = interaction.extras.pop('metrics', None)
+        if interaction_metrics is None:
+            return
+        seconds = time.perf_counter() - interaction_metrics.started - interaction_metrics.user_seconds
+        with self._lock:
+            stats = self.commands.setdefault(interaction_metrics.command, CommandStats())
+            stats.duration.observe(seconds)
+            stats.recent.append(seconds)
+            stats.errors += failed
+            stats.queries += len(interaction_metrics.queries)
+            stats.db_seconds += interaction_metrics.db_seconds
+        if seconds >= SLOW_COMMAND_SECONDS:
+            sample = {
+                'command': interaction_metrics.command,
+                'guild_id': interaction.guild_id,
+                'at': time.time(),
+                'seconds': seconds,
+                'db_seconds': interaction_metrics.db_seconds,
+                'acquire_seconds': interaction_metrics.acquire_seconds,
+                'queries': list(interaction_metrics.queries),
+            }
+            self.slow.append(sample)
+            print(f"Slow command /{sample['command']}: {seconds * 1000:.0f} ms, {len(sample['queries'])} queries taking "
+                  f"{sample['db_seconds'] * 1000:.0f} ms (" + ", ".join(f"{label} {query * 1000:.0f} ms" for label, query in sample['queries']) + ")", flush=True)
+
+metrics = Metrics()
+
+# Command tree that times every slash command from the start of its handler, where it defers,
+# until the handler returns after its last followup, less the time it waited for the user (Metrics.user_wait).
+# Migrations run while the bot connects (client.schema_ready), so interactions arriving before they are done
+# would see the old schema. Commands wait for them briefly and are otherwise asked to try again.
+class InstrumentedTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        schema_ready = self.client.schema_ready
+        if not schema_ready.done():
+            await asyncio.wait([schema_ready], timeout=SCHEMA_WAIT_SECONDS)
+        # a failed migration turns every command away rather than letting them run against a half-migrated schema,
+        # the error itself is raised by on_ready
+        if not schema_ready.done() or schema_ready.cancelled() or schema_ready.exception():
+            if interaction.type is discord.InteractionType.application_command:
+                reply = "The bot is updating its database, please try again in a moment." if not schema_ready.done() else "The bot could not update its database, please tell the bot's administrator."
+                await interaction.response.send_message(reply, ephemeral=True)
+            return False
+        if interaction.type is discord.InteractionType.application_command:
+            metrics.command_started(interaction)
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        metrics.command_finished(interaction, failed=True)
+        await super().on_error(interaction, error)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def cache_stats():
+    from .messaging import get_webhook_stats
+    from .name_index import name_index
+    webhooks = get_webhook_stats()
+    return {
+        'character': character_cache.stats(),
+        'permission': permission_cache.stats(),
+        'webhook': {'hits': webhooks['rest_calls_saved'], 'misses': webhooks['rest_lookups']},
+    }, name_index.stats()
+
+def render_prometheus(client=None):
+    lines = []
+    def histogram(name, help, samples):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, hist in samples:
+            prefix = labels + ',' if labels else ''
+            for bound, count in zip(BUCKETS, hist.counts):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {hist.count}')
+            suffix = '{' + labels + '}' if labels else ''
+            lines.append(f"{name}_sum{suffix} {hist.sum}")
+            lines.append(f"{name}_count{suffix} {hist.count}")
+    def counter(name, help, samples, type='counter'):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {type}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    with metrics._lock:
+        commands = sorted(metrics.commands.items())
+        histogram('npc_command_duration_seconds', 'Slash command handler time, from the defer to the last followup, without time spent waiting for the user.',
+                  [(f'command="{name}"', stats.duration) for name, stats in commands])
+        counter('npc_command_errors_total', 'Slash commands that raised an error.', [(f'command="{name}"', stats.errors) for name, stats in commands])
+        counter('npc_command_queries_total', 'Database calls made by slash commands.', [(f'command="{name}"', stats.queries) for name, stats in commands])
+        counter('npc_command_db_seconds_total', 'Time slash commands spent in the database.', [(f'command="{name}"', stats.db_seconds) for name, stats in commands])
+        histogram('npc_db_query_duration_seconds', 'Database call time, including acquiring a pooled session.', [('', metrics.queries)])
+        histogram('npc_db_acquire_duration_seconds', 'Time to acquire a session from the Oracle pool.', [('', metrics.acquire)])
+
+    caches, index = cache_stats()
+    counter('npc_cache_hits_total', 'Cache lookups answered from memory.', [(f'cache="{name}"', stats['hits']) for name, stats in caches.items()])
+    counter('npc_cache_misses_total', 'Cache lookups that went to the database or Discord.', [(f'cache="{name}"', stats['misses']) for name, stats in caches.items()])
+    counter('npc_name_index_entries', 'Names held by the autocomplete index.', [(f'kind="{kind}"', index[kind]) for kind in ('guilds', 'characters', 'items')], type='gauge')
+
+    from .backup import backup_scheduler
+    backups = backup_scheduler.stats()
+    counter('npc_backup_requests_total', 'Backups requested by character and inventory changes.', [('', backups['requested'])])
+    counter('npc_backup_coalesced_total', 'Backup requests folded into an export already scheduled for the guild.', [('', backups['coalesced'])])
+    counter('npc_backup_exports_total', 'Backups uploaded, by outcome.', [('outcome="exported"', backups['exports']), ('outcome="failed"', backups['failed'])])
+    counter('npc_backup_pending', 'Guilds with a backup waiting for its window to end.', [('', backups['pending'])], type='gauge')
+
+    from .messaging import send_queue
+    queue = send_queue.stats()
+    counter('npc_webhook_queue_depth', 'Character messages waiting to be posted.', [('', queue['queue_depth'])], type='gauge')
+    counter('npc_webhook_queues', 'Webhooks with a send queue.', [('', queue['active_webhooks'])], type='gauge')
+    counter('npc_webhook_messages_total', 'Character messages by outcome.', [(f'outcome="{outcome}"', queue[outcome]) for outcome in ('sent', 'failed')])
+    counter('npc_webhook_retries_total', 'Webhook posts retried after a rate limit, server or connection error.', [('', queue['retries'])])
+    counter('npc_webhook_rate_limited_total', 'Webhook posts answered with a 429.', [('', queue['rate_limited'])])
+    counter('npc_webhook_queue_wait_seconds_total', 'Time from queueing a character message until it was posted.', [('', queue['total_wait'])])
+    counter('npc_webhook_queue_wait_max_seconds', 'Longest time from queueing a character message until it was posted.', [('', queue['max_wait'])], type='gauge')
+
+    if client is not None:
+        from .shards import shard_stats
+        shards = shard_stats(client)
+        counter('npc_shard_latency_seconds', 'Gateway heartbeat latency per shard.',
+                [(f'shard="{shard["shard_id"]}"', shard['latency']) for shard in shards if shard['latency'] is not None], type='gauge')
+        counter('npc_shard_guilds', 'Guilds per shard.', [(f'shard="{shard["shard_id"]}"', shard['guilds']) for shard in shards], type='gauge')
+    return "\n".join(lines) + "\n"
+
+def format_stats(client=None):
+    lines = ["**Commands** (count, p50 / p95 / max ms, queries per call, DB ms per call, errors)"]
+    with metrics._lock:
+        commands = sorted(metrics.commands.items(), key=lambda item: -item[1].duration.sum)
+        slow = list(metrics.slow)[-5:]
+        acquire = metrics.acquire
+    for name, stats in commands:
+        count = stats.duration.count
+        lines.append(
+            f"/{name}: {count}, {percentile(stats.recent, 0.5) * 1000:.0f} / {percentile(stats.recent, 0.95) * 1000:.0f} / "
+            f"{max(stats.recent, default=0) * 1000:.0f} ms, {stats.queries / count:.1f} queries, "
+            f"{stats.db_seconds / count * 1000:.0f} ms DB, {stats.errors} errors"
+        )
+    if acquire.count:
+        lines.append(f"**Pool** {acquire.count} acquires, {acquire.sum / acquire.count * 1000:.1f} ms on average")
+    caches, index = cache_stats()
+    lines.append("**Caches** " + ", ".join(
+        f"{name} {stats['hits'] / max(1, stats['hits'] + stats['misses']):.0%} hits" for name, stats in caches.items()
+    ) + f", name index {index['characters']} characters / {index['items']} items in {index['guilds']} guilds")
+    from .backup import backup_scheduler
+    backups = backup_scheduler.stats()
+    lines.append(
+        f"**Backups** {backups['requested']} requested, {backups['coalesced']} coalesced into {backups['exports']} exports, "
+        f"{backups['failed']} failed, {backups['pending']} guilds pending"
+    )
+    from .messaging import send_queue
+    queue = send_queue.stats()
+    lines.append(
+        f"**Webhook queue** {queue['queue_depth']} waiting on {queue['active_webhooks']} webhooks, {queue['sent']} sent, {queue['failed']} failed, "
+        f"{queue['retries']} retries, {queue['rate_limited']} rate limited, waited {queue['avg_wait'] * 1000:.0f} ms on average / {queue['max_wait'] * 1000:.0f} ms at most"
+    )
+    if client is not None:
+        from .shards import format_shard_stats
+        lines.append("**Shards** " + format_shard_stats(client).replace("\n", "; "))
+    if slow:
+        lines.append(f"**Slow commands** (over {SLOW_COMMAND_SECONDS:g} s)")
+        for sample in slow:
+            top = sorted(sample['queries'], key=lambda query: -query[1])[:3]
+            lines.append(
+                f"/{sample['command']} <t:{int(sample['at'])}:R>: {sample['seconds'] * 1000:.0f} ms, {len(sample['queries'])} queries, "
+                f"{sample['db_seconds'] * 1000:.0f} ms DB; slowest " + ", ".join(f"`{label}` {seconds * 1000:.0f} ms" for label, seconds in top)
+            )
+    return "\n".join(lines)
+
+# Serve the metrics in the Prometheus text format on METRICS_PORT, bound to METRICS_HOST (localhost by default).
+# Returns the runner to clean up on shutdown, or None when METRICS_PORT isn't set.
+async def start_metrics_server(client=None):
+    port = os.environ.get('METRICS_PORT')
+    if not port:
+        return None
+    async def handle(request):
+        return web.Response(text=render_prometheus(client), content_type='text/plain', charset='utf-8')
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, os.environ.get('METRICS_HOST', '127.0.0.1'), int(port)).start()
+    return runner
+
+@app_commands.command(name="npc_stats", description="Show command latency, database and cache statistics for the bot")
+@app_commands.default_permissions(administrator=True)
+async def npc_stats(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    text = format_stats(interaction.client)
+    if len(text) > 1900:
+        await interaction.followup.send(text[:1900].rsplit("\n", 1)[0], file=discord.File(io.BytesIO(text.encode('utf-8')), filename='npc_stats.txt'), ephemeral=True)
+    else:
+        await interaction.followup.send(text, ephemeral=True)
@@ -0,0 +1,166 @@
+import asyncio
+import bisect
+import os
+from discord import app_commands
+from . import db
+
+# Discord shows at most 25 autocomplete choices
+MAX_CHOICES = 25
+# guilds loaded at once when the bot starts, the rest of the database threads are left to commands
+PRELOAD_CONCURRENCY = int(os.environ.get('NAME_INDEX_PRELOAD_CONCURRENCY', 2))
+
+# Case-insensitive sorted list of names, prefix lookups are a binary search
+class SortedNames:
+    def __init__(self, names=()):
+        self._entries = sorted((name.casefold(), name) for name in names)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name):
+        entry = (name.casefold(), name)
+        index = bisect.bisect_left(self._entries, entry)
+        if index == len(self._entries) or self._entries[index] != entry:
+            self._entries.insert(index, entry)
+
+    def remove(self, name):
+        entry = (name.casefold(), name)
+        index = bisect.bisect_left(self._entries, entry)
+        if index < len(self._entries) and self._entries[index] == entry:
+            del self._entries[index]
+
+    def complete(self, prefix, limit=MAX_CHOICES):
+        key = prefix.casefold()
+        names = []
+        for index in range(bisect.bisect_left(self._entries, (key,)), len(self._entries)):
+            entry_key, name = self._entries[index]
+            if not entry_key.startswith(key) or len(names) == limit:
+                break
+            names.append(name)
+        return names
+
+# Character and item names of each guild, kept in memory so autocomplete never waits on Oracle.
+# A guild is loaded in the background the first time someone autocompletes in it and then kept up to date
+# by the commands that create, rename or delete characters and items.
+# Only touched from the event loop, so it needs no locking.
+class NameIndex:
+    def __init__(self):
+        self._characters = {}
+        self._items = {}
+        self._loading = {}
+        # bumped on every change, a load that overlapped a change is thrown away and retried
+        self._versions = {}
+
+    def characters(self, guild_id):
+        self.load(guild_id)
+        return self._characters.get(guild_id)
+
+    def items(self, guild_id, character_name):
+        self.load(guild_id)
+        if guild_id not in self._characters:
+            return None
+        return self._items.get((guild_id, character_name))
+
+    # start loading a guild in the background unless it is loaded or already loading
+    def load(self, guild_id):
+        if guild_id not in self._characters and guild_id not in self._loading:
+            self._loading[guild_id] = asyncio.create_task(self._load(guild_id))
+
+    # load the guilds a few at a time, so commands arriving right after start-up don't queue behind thousands of loads
+    async def preload(self, guild_ids):
+        slots = asyncio.Semaphore(PRELOAD_CONCURRENCY)
+        async def load_one(guild_id):
+            async with slots:
+                self.load(guild_id)
+                loading = self._loading.get(guild_id)
+                if loading:
+                    await loading
+        await asyncio.gather(*(load_one(guild_id) for guild_id in guild_ids))
+
+    async def _load(self, guild_id):
+        try:
+            while True:
+                version = self._versions.get(guild_id, 0)
+                rows = await db.fetchall('''
+                    SELECT c.character_name, i.name
+                    FROM characters c LEFT JOIN inventory i ON i.character_id = c.id
+                    WHERE c.guild_id = :guild_id
+                ''', {'guild_id': guild_id})
+                if version == self._versions.get(guild_id, 0):
+                    break
+            items = {}
+            for character_name, item_name in rows:
+                names = items.setdefault(character_name, [])
+                if item_name is not None:
+                    names.append(item_name)
+            self._characters[guild_id] = SortedNames(items)
+            for character_name, names in items.items():
+                self._items[(guild_id, character_name)] = SortedNames(names)
+        except Exception as e:
+            print(f"Failed to load the name index of guild {guild_id}: {e}")
+        finally:
+            del self._loading[guild_id]
+
+    def _changed(self, guild_id):
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        return guild_id in self._characters
+
+    def add_character(self, guild_id, name):
+        if self._changed(guild_id):
+            self._characters[guild_id].add(name)
+            self._items.setdefault((guild_id, name), SortedNames())
+
+    def remove_character(self, guild_id, name):
+        if self._changed(guild_id):
+            self._characters[guild_id].remove(name)
+            self._items.pop((guild_id, name), None)
+
+    def rename_character(self, guild_id, name, new_name):
+        if self._changed(guild_id):
+            self._characters[guild_id].remove(name)
+            self._characters[guild_id].add(new_name)
+            self._items[(guild_id, new_name)] = self._items.pop((guild_id, name), SortedNames())
+
+    def add_item(self, guild_id, character_name, name):
+        if self._changed(guild_id):
+            self._items.setdefault((guild_id, character_name), SortedNames()).add(name)
+
+    def remove_item(self, guild_id, character_name, name):
+        if self._changed(guild_id) and (guild_id, character_name) in self._items:
+            self._items[(guild_id, character_name)].remove(name)
+
+    def rename_item(self, guild_id, character_name, name, new_name):
+        self.remove_item(guild_id, character_name, name)
+        self.add_item(guild_id, character_name, new_name)
+
+    # forget a guild after bulk changes, it is reloaded on the next autocomplete
+    def invalidate(self, guild_id):
+        self._changed(guild_id)
+        self._characters.pop(guild_id, None)
+        for key in [key for key in self._items if key[0] == guild_id]:
+            del self._items[key]
+
+    def stats(self):
+        return {
+            'guilds': len(self._characters),
+            'characters': sum(len(names) for names in self._characters.values()),
+            'items': sum(len(names) for names in self._items.values()),
+            'loading': len(self._loading),
+        }
+
+name_index = NameIndex()
+
+def choices(names, current):
+    if names is None:
+        return []
+    return [app_commands.Choice(name=name, value=name) for name in names.complete(current)]
+
+async def character_autocomplete(interaction, current: str):
+    return choices(name_index.characters(str(interaction.guild_id)), current)
+
+# items of the character picked in the same command, which is always the `character` option
+async def item_autocomplete(interaction, current: str):
+    character_name = getattr(interaction.namespace, 'character', None)
+    if not character_name:
+        return []
+    return choices(name_index.items(str(interaction.guild_id), character_name), current)
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import discord
+from . import db
+from .backup import GuildDebounce
+from .guild_config import guild_config, TRANSACTION_CHANNEL
+
+# receipts read from the ledger per query, and the Discord message length they are packed into
+RECEIPT_BATCH_SIZE = 100
+MESSAGE_LIMIT = 2000
+
+TRANSACTION_COLUMNS = ['guild_id', 'character_id', 'character_name', 'item_name', 'buyer_id', 'buyer_name', 'quantity', 'price', 'discounted', 'interaction_id']
+
+PENDING_SQL = f'''
+    SELECT id, buyer_name, quantity, item_name, price, character_name, discounted, interaction_id
+    FROM transactions
+    WHERE published = 0 AND guild_id = :guild_id
+    ORDER BY id
+    {db.backend.LIMIT_SQL}
+'''
+
+# record a purchase in the ledger, run in the same transaction as the stock change
+def record_transaction(cursor, sale):
+    cursor.execute(f'''
+        INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)})
+        VALUES ({', '.join(':' + column for column in TRANSACTION_COLUMNS)})
+    ''', {column: sale[column] for column in TRANSACTION_COLUMNS})
+
+# Mark exactly the rows that were posted. Ids don't commit in order (Oracle caches identity values per session,
+# and a purchase with a lower id can commit after the batch was read), so an id range could cover unposted rows.
+def mark_published(cursor, transaction_ids):
+    cursor.executemany("UPDATE transactions SET published = 1 WHERE id = :id", [{'id': transaction_id} for transaction_id in transaction_ids])
+
+def format_line(quantity, item_name, price, discounted):
+    line = f"{quantity} of item `{item_name}` for {price} gold"
+    if discounted:
+        line += " with a discount"
+    return line
+
+# one receipt per purchase, the lines of a /buy cart share their interaction and are listed together
+def format_receipts(rows):
+    purchases = {}
+    for row in rows:
+        # ledger rows written before interactions were recorded are receipts of their own
+        purchases.setdefault(row[7] or ('row', row[0]), []).append(row)
+    receipts = []
+    for lines in purchases.values():
+        _, buyer_name, quantity, item_name, price, character_name, discounted, _ = lines[0]
+        if len(lines) == 1:
+            receipts.append(f"Player `{buyer_name}` bought {format_line(quantity, item_name, price, discounted)} from {character_name}")
+        else:
+            total = sum(line[4] for line in lines)
+            receipts.append(f"Player `{buyer_name}` bought from {character_name} for {total} gold:\n" + "\n".join(
+                "- " + format_line(line[2], line[3], line[4], line[6]) for line in lines
+            ))
+    return receipts
+
+# pack receipts into as few messages as fit Discord's length limit
+def pack_receipts(receipts):
+    messages = []
+    for receipt in receipts:
+        if messages and len(messages[-1]) + 1 + len(receipt) <= MESSAGE_LIMIT:
+            messages[-1] += "\n" + receipt
+        else:
+            messages.append(receipt[:MESSAGE_LIMIT])
+    return messages
+
+async def create_transaction_channel(guild: discord.Guild):
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+        guild.me: discord.PermissionOverwrite(read_messages=True)
+    }
+    channel = await guild.create_text_channel(TRANSACTION_CHANNEL, overwrites=overwrites)
+    await channel.edit(topic="NPC-generated channel for posting transaction data.")
+    await guild_config.set_channel(guild, 'transactions', channel)
+    return channel
+
+# Posts purchase receipts to the transactions channel from the ledger, write-behind: the first purchase in a guild
+# starts a window of delay seconds and every purchase made during it goes out in the same message.
+# Receipts are marked published only after Discord accepted them, so ones still pending when the bot stops are
+# posted after the restart (a crash between the post and the update can repeat a batch, never lose one).
+class ReceiptPublisher:
+    def __init__(self, delay):
+        self.requested = 0
+        self.messages = 0
+        self.receipts = 0
+        self.failed = 0
+        self._debounce = GuildDebounce(delay, self._publish)
+        self._locks = {}
+
+    def schedule(self, guild: discord.Guild):
+        self.requested += 1
+        self._debounce.schedule(guild)
+
+    async def _publish(self, guild):
+        # one publisher per guild at a time, so a batch is never posted twice
+        async with self._locks.setdefault(guild.id, asyncio.Lock()):
+            try:
+                while await self._publish_batch(guild):
+                    pass
+            except Exception as e:
+                self.failed += 1
+                print(f"Posting receipts for guild {guild.id} failed: {e}")
+
+    async def _publish_batch(self, guild):
+        guild_id = str(guild.id)
+        rows = await db.fetchall(PENDING_SQL, {'guild_id': guild_id, 'limit': RECEIPT_BATCH_SIZE})
+        if not rows:
+            return False
+        channel = await guild_config.channel(guild, 'transactions') or await create_transaction_channel(guild)
+        for message in pack_receipts(format_receipts(rows)):
+            await channel.send(message)
+            self.messages += 1
+        await db.transaction(mark_published, [row[0] for row in rows])
+        self.receipts += len(rows)
+        return len(rows) == RECEIPT_BATCH_SIZE
+
+    # after a restart, post what was still pending for the guilds this process serves
+    async def resume(self, client):
+        rows = await db.fetchall("SELECT DISTINCT guild_id FROM transactions WHERE published = 0")
+        for (guild_id,) in rows:
+            guild = client.get_guild(int(guild_id))
+            if guild:
+                self.schedule(guild)
+
+    # post every pending guild right away, used on shutdown
+    async def flush(self):
+        await self._debounce.flush()
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'messages': self.messages,
+            'receipts': self.receipts,
+            'failed': self.failed,
+            'pending': len(self._debounce),
+        }
+
+receipt_publisher = ReceiptPublisher(delay=float(os.environ.get('RECEIPT_DELAY', 10)))
@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+import aiohttp
+import discord
+
+# Serialises webhook posts per webhook so character messages keep their order, and paces them by Discord's
+# rate limit headers. A 429 waits out Retry-After and retries; server and network errors back off and retry.
+# send() returns only once Discord has accepted the message.
+class WebhookSendQueue:
+    def __init__(self, session_factory, max_retries=5):
+        self.session_factory = session_factory
+        self.max_retries = max_retries
+        self._queues = {}
+        self._workers = set()
+        # webhook url -> monotonic time its rate limit bucket resets, set when the bucket is used up
+        self._bucket_resets = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def send(self, webhook_url, payload):
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(webhook_url)
+        if queue is None:
+            queue = self._queues[webhook_url] = asyncio.Queue()
+            worker = asyncio.create_task(self._work(webhook_url, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.put_nowait((payload, future, time.monotonic()))
+        return await future
+
+    # one worker per webhook while it has messages queued
+    async def _work(self, webhook_url, queue):
+        try:
+            while not queue.empty():
+                payload, future, queued_at = queue.get_nowait()
+                if future.cancelled():
+                    continue
+                try:
+                    message = await self._post(webhook_url, payload)
+                except Exception as e:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                wait = time.monotonic() - queued_at
+                self.sent += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                if not future.done():
+                    future.set_result(message)
+        finally:
+            del self._queues[webhook_url]
+
+    async def _post(self, webhook_url, payload):
+        session = await self.session_factory()
+        for attempt in range(self.max_retries + 1):
+            reset_at = self._bucket_resets.pop(webhook_url, None)
+            if reset_at and reset_at > time.monotonic():
+                await asyncio.sleep(reset_at - time.monotonic())
+            if attempt:
+                self.retries += 1
+
+            try:
+                async with session.post(webhook_url, params={'wait': 'true'}, json=payload) as response:
+                    self._update_bucket(webhook_url, response.headers)
+                    data = await read_json(response)
+                    if response.status < 300:
+                        return data
+                    if response.status == 429:
+                        self.rate_limited += 1
+                        retry_after = (data or {}).get('retry_after') or response.headers.get('Retry-After', 1)
+                        await asyncio.sleep(float(retry_after))
+                        continue
+                    if response.status == 404:
+                        raise discord.NotFound(response, data or 'Unknown Webhook')
+                    if response.status < 500 or attempt == self.max_retries:
+                        raise discord.HTTPException(response, data or '')
+            except aiohttp.ClientError:
+                if attempt == self.max_retries:
+                    raise
+            # exponential backoff with jitter for server and connection errors
+            await asyncio.sleep(min(30, 2 ** attempt) * (0.5 + random.random() / 2))
+        raise discord.HTTPException(response, 'Still rate limited after retrying')
+
+    def _update_bucket(self, webhook_url, headers):
+        if headers.get('X-RateLimit-Remaining') == '0' and headers.get('X-RateLimit-Reset-After'):
+            self._bucket_resets[webhook_url] = time.monotonic() + float(headers['X-RateLimit-Reset-After'])
+
+    def stats(self):
+        return {
+            'queue_depth': sum(queue.qsize() for queue in self._queues.values()),
+            'active_webhooks': len(self._queues),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'total_wait': self.total_wait,
+            'avg_wait': self.total_wait / self.sent if self.sent else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+async def read_json(response):
+    try:
+        return await response.json(content_type=None)
+    except ValueError:
+        return None
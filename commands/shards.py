@@ -0,0 +1,48 @@
+import math
+import os
+
+# parse SHARD_IDS, a comma separated list of shard ids and ranges such as "0-3,8"
+def parse_shard_ids(value):
+    if not value:
+        return None
+    shard_ids = []
+    for part in value.split(','):
+        start, _, end = part.strip().partition('-')
+        shard_ids.extend(range(int(start), int(end or start) + 1))
+    return shard_ids
+
+def format_shard_ids(shard_ids):
+    return f"{shard_ids[0]}-{shard_ids[-1]}" if len(shard_ids) > 1 else str(shard_ids[0])
+
+# sharding options for AutoShardedBot: SHARD_COUNT shards in total, of which this process runs SHARD_IDS.
+# Without either, discord.py asks Discord for the recommended shard count and runs all of them.
+def shard_config():
+    shard_count = os.environ.get('SHARD_COUNT')
+    shard_ids = parse_shard_ids(os.environ.get('SHARD_IDS'))
+    if shard_ids and not shard_count:
+        raise ValueError("SHARD_IDS needs SHARD_COUNT, the total number of shards across all processes")
+    return {'shard_count': int(shard_count) if shard_count else None, 'shard_ids': shard_ids}
+
+# latency and guild count of every shard this process runs
+def shard_stats(client):
+    guilds = {}
+    for guild in client.guilds:
+        guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+    stats = []
+    for shard_id, latency in sorted(client.latencies):
+        shard = client.get_shard(shard_id)
+        stats.append({
+            'shard_id': shard_id,
+            'latency': None if math.isinf(latency) or math.isnan(latency) else latency,
+            'guilds': guilds.get(shard_id, 0),
+            'closed': shard.is_closed() if shard else True,
+        })
+    return stats
+
+def format_shard_stats(client):
+    lines = [f"{client.shard_count} shards in total, this process runs {len(client.latencies)} with {len(client.guilds)} guilds"]
+    for shard in shard_stats(client):
+        latency = 'n/a' if shard['latency'] is None else f"{shard['latency'] * 1000:.0f} ms"
+        state = ' (disconnected)' if shard['closed'] else ''
+        lines.append(f"shard {shard['shard_id']}: {shard['guilds']} guilds, latency {latency}{state}")
+    return "\n".join(lines)
@@ -0,0 +1,13 @@
+import os
+
+# Where characters, inventories and webhooks are stored: "oracle" (default) or "sqlite" for small deployments and CI.
+# Both backends provide the same functions. Plain SELECT, UPDATE and DELETE statements with :name binds run
+# unchanged on either, so commands only go through the backend for what the dialects do differently.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'oracle').lower()
+
+if STORAGE_BACKEND == 'oracle':
+    from . import oracle as backend
+elif STORAGE_BACKEND == 'sqlite':
+    from . import sqlite as backend
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, expected 'oracle' or 'sqlite'")
@@ -0,0 +1,166 @@
+import os
+import oracledb
+
+NAME = 'oracle'
+# one executor worker per pooled session: extra queries queue in the executor rather than tying up threads in pool.acquire()
+WORKERS = int(os.environ.get('ORACLE_POOL_MAX', 8))
+LIMIT_SQL = "FETCH FIRST :limit ROWS ONLY"
+
+# return CLOBs as plain strings so rows can be used after their session goes back to the pool
+oracledb.defaults.fetch_lobs = False
+
+# process-wide session pool, created once by the bot (or the migration runner) and shared by every command
+_pool = None
+
+def start():
+    global _pool
+    if _pool is None:
+        _pool = oracledb.create_pool(
+            user=os.environ.get('ORACLE_USER'),
+            password=os.environ.get('ORACLE_PASSWORD'),
+            dsn=os.environ.get('ORACLE_DSN'),
+            min=int(os.environ.get('ORACLE_POOL_MIN', 1)),
+            max=int(os.environ.get('ORACLE_POOL_MAX', 8)),
+            increment=int(os.environ.get('ORACLE_POOL_INCREMENT', 1)),
+            # wait this many milliseconds for a free session before failing, instead of blocking forever
+            getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+            wait_timeout=int(os.environ.get('ORACLE_POOL_WAIT_TIMEOUT', 5000)),
+            # close sessions that have been idle this many seconds, down to the pool minimum
+            timeout=int(os.environ.get('ORACLE_POOL_IDLE_TIMEOUT', 300)),
+            # ping sessions that have been idle this many seconds before handing them out, so stale ones are replaced
+            ping_interval=int(os.environ.get('ORACLE_POOL_PING_INTERVAL', 60)),
+        )
+    return _pool
+
+def stop():
+    global _pool
+    if _pool is not None:
+        _pool.close(force=True)
+        _pool = None
+
+# borrow a session from the shared pool; connection.close() hands it back
+def connect():
+    return start().acquire()
+
+# Oracle starts a transaction with the first DML statement
+def begin(connection):
+    pass
+
+def migrate():
+    from db_migrations import run_migrations
+    run_migrations.main()
+
+### CHARACTERS ###
+
+def insert_character(cursor, guild_id, name, owner_id, image_url, background):
+    character_id = cursor.var(int)
+    cursor.execute('''
+        INSERT INTO characters (guild_id, character_name, owner_id, image_url, background)
+        VALUES (:guild_id, :name, :owner_id, :image_url, :background)
+        RETURNING id INTO :id
+    ''', {
+        "guild_id": guild_id,
+        "name": name,
+        "owner_id": owner_id,
+        "image_url": image_url,
+        "background": background,
+        "id": character_id
+    })
+    return character_id.getvalue()[0]
+
+# allowing someone twice is a no-op
+def allow_user(cursor, character_id, user_id):
+    cursor.execute('''
+        MERGE INTO character_permissions p
+        USING (SELECT :character_id AS character_id, :user_id AS user_id FROM dual) s
+        ON (p.character_id = s.character_id AND p.user_id = s.user_id)
+        WHEN NOT MATCHED THEN INSERT (character_id, user_id) VALUES (s.character_id, s.user_id)
+    ''', {"character_id": character_id, "user_id": user_id})
+
+# insert or update characters by (guild_id, character_name), rows are dicts with the characters columns
+def merge_characters(cursor, rows):
+    cursor.executemany('''
+        MERGE INTO characters c
+        USING (
+            SELECT :guild_id AS guild_id, :character_name AS character_name, :owner_id AS owner_id,
+                   :image_url AS image_url, :background AS background
+            FROM dual
+        ) s
+        ON (c.guild_id = s.guild_id AND c.character_name = s.character_name)
+        WHEN MATCHED THEN UPDATE SET c.owner_id = s.owner_id, c.image_url = s.image_url, c.background = s.background
+        WHEN NOT MATCHED THEN INSERT (guild_id, character_name, owner_id, image_url, background)
+            VALUES (s.guild_id, s.character_name, s.owner_id, s.image_url, s.background)
+    ''', rows)
+
+### INVENTORY ###
+
+def insert_items(cursor, rows):
+    cursor.setinputsizes(info=oracledb.DB_TYPE_VARCHAR)
+    cursor.executemany('''
+        INSERT INTO inventory (id, character_id, name, quantity, info, price, discount, discount_threshold)
+        VALUES (inventory_seq.nextval, :character_id, :name, :quantity, :info, :price, :discount, :discount_threshold)
+    ''', rows)
+
+# Upsert one item per row. Fields left empty keep their current value, or the /add_inventory default for new items.
+# Restocking adds the quantity to the current stock instead of replacing it.
+UPSERT_ITEM_SQL = '''
+    MERGE INTO inventory i
+    USING (
+        SELECT :character_id AS character_id, :name AS name, :quantity AS quantity, :info AS info,
+               :price AS price, :discount AS discount, :discount_threshold AS discount_threshold
+        FROM dual
+    ) s
+    ON (i.character_id = s.character_id AND i.name = s.name)
+    WHEN MATCHED THEN UPDATE SET
+        i.quantity = {quantity}, i.info = NVL(s.info, i.info), i.price = NVL(s.price, i.price),
+        i.discount = NVL(s.discount, i.discount), i.discount_threshold = NVL(s.discount_threshold, i.discount_threshold)
+    WHEN NOT MATCHED THEN INSERT (id, character_id, name, quantity, info, price, discount, discount_threshold)
+        VALUES (inventory_seq.nextval, s.character_id, s.name, NVL(s.quantity, 0), s.info,
+                NVL(s.price, 1), NVL(s.discount, 0), NVL(s.discount_threshold, 0))
+'''
+UPSERT_SQL = {
+    'update': UPSERT_ITEM_SQL.format(quantity='NVL(s.quantity, i.quantity)'),
+    'restock': UPSERT_ITEM_SQL.format(quantity='i.quantity + NVL(s.quantity, 0)'),
+}
+
+def upsert_items(cursor, rows, mode):
+    cursor.setinputsizes(
+        quantity=oracledb.DB_TYPE_NUMBER, price=oracledb.DB_TYPE_NUMBER,
+        discount=oracledb.DB_TYPE_NUMBER, discount_threshold=oracledb.DB_TYPE_NUMBER, info=oracledb.DB_TYPE_VARCHAR
+    )
+    cursor.executemany(UPSERT_SQL[mode], rows)
+
+# Take quantity out of stock only if enough is left, checked by the UPDATE itself so concurrent buyers can't oversell.
+# Returns the remaining stock, or None if there wasn't enough.
+def purchase_item(cursor, item_id, quantity):
+    remaining = cursor.var(int)
+    cursor.execute(
+        "UPDATE inventory SET quantity = quantity - :quantity WHERE id = :id AND quantity >= :quantity RETURNING quantity INTO :remaining",
+        {'quantity': quantity, 'id': item_id, 'remaining': remaining}
+    )
+    if cursor.rowcount == 0:
+        return None
+    return remaining.getvalue()[0]
+
+### WEBHOOKS ###
+
+def save_webhook(cursor, channel_id, guild_id, webhook_url):
+    cursor.execute('''
+        MERGE INTO webhooks w
+        USING (SELECT :channel_id AS channel_id, :guild_id AS guild_id, :webhook_url AS webhook_url FROM dual) s
+        ON (w.channel_id = s.channel_id)
+        WHEN MATCHED THEN UPDATE SET w.webhook_url = s.webhook_url
+        WHEN NOT MATCHED THEN INSERT (channel_id, guild_id, webhook_url) VALUES (s.channel_id, s.guild_id, s.webhook_url)
+    ''', {'channel_id': channel_id, 'guild_id': guild_id, 'webhook_url': webhook_url})
+
+### GUILD CONFIG ###
+
+# column is one of the guild_config setting columns, never user input
+def save_guild_setting(cursor, guild_id, column, value):
+    cursor.execute(f'''
+        MERGE INTO guild_config g
+        USING (SELECT :guild_id AS guild_id, :value AS value FROM dual) s
+        ON (g.guild_id = s.guild_id)
+        WHEN MATCHED THEN UPDATE SET g.{column} = s.value
+        WHEN NOT MATCHED THEN INSERT (guild_id, {column}) VALUES (s.guild_id, s.value)
+    ''', {'guild_id': guild_id, 'value': value})
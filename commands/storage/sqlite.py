@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import threading
+
+NAME = 'sqlite'
+# SQLite serialises writers, a few threads are enough to keep reads concurrent
+WORKERS = int(os.environ.get('SQLITE_WORKERS', 4))
+LIMIT_SQL = "LIMIT :limit"
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'npc.sqlite3'))
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'db_migrations', 'sqlite')
+# milliseconds a writer waits for another one to finish before failing
+BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+
+# Each executor thread keeps one connection to the database file open, the SQLite counterpart of a session pool.
+# close() leaves it open so callers can treat it like a pooled session.
+class Connection:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self):
+        return self._connection.cursor()
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        pass
+
+# thread id -> that thread's connection
+_connections = {}
+_lock = threading.Lock()
+
+def start():
+    # create the file and switch it to write-ahead logging, so readers don't wait for writers
+    connect()
+
+def stop():
+    with _lock:
+        for connection in _connections.values():
+            connection._connection.close()
+        _connections.clear()
+
+def connect():
+    connection = _connections.get(threading.get_ident())
+    if connection is None:
+        raw = sqlite3.connect(SQLITE_PATH, timeout=BUSY_TIMEOUT / 1000, isolation_level=None, check_same_thread=False)
+        raw.execute("PRAGMA journal_mode = WAL")
+        raw.execute("PRAGMA synchronous = NORMAL")
+        raw.execute("PRAGMA foreign_keys = ON")
+        connection = Connection(raw)
+        with _lock:
+            _connections[threading.get_ident()] = connection
+    return connection
+
+# Connections run in autocommit mode, so single statements commit on their own. Transactions take the write lock
+# up front: a deferred one that reads before writing can fail with SQLITE_BUSY instead of waiting.
+def begin(connection):
+    connection._connection.execute("BEGIN IMMEDIATE")
+
+# Apply the numbered .sql files in db_migrations/sqlite newer than the database's user_version,
+# each in its own transaction (DDL is transactional in SQLite).
+# Foreign keys are off while they run, so a migration can rebuild a table without its DROP TABLE cascading
+# into the tables referencing it; the references are checked before each migration commits.
+def migrate():
+    connection = connect()._connection
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    connection.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for file in sorted(os.listdir(MIGRATIONS_DIR)):
+            number = int(file.split('_', 1)[0]) if file.endswith('.sql') else 0
+            if number <= version:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, file)) as f:
+                script = f.read()
+            try:
+                connection.executescript(f"BEGIN IMMEDIATE;\n{script}\n;PRAGMA user_version = {number};")
+                if connection.execute("PRAGMA foreign_key_check").fetchone():
+                    raise Exception(f"Migration {file} left rows referencing missing rows")
+                connection.execute("COMMIT")
+            except Exception:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+            print(f"Migration {file} has been run successfully")
+    finally:
+        connection.execute("PRAGMA foreign_keys = ON")
+
+### CHARACTERS ###
+
+def insert_character(cursor, guild_id, name, owner_id, image_url, background):
+    cursor.execute('''
+        INSERT INTO characters (guild_id, character_name, owner_id, image_url, background)
+        VALUES (:guild_id, :name, :owner_id, :image_url, :background)
+    ''', {
+        "guild_id": guild_id,
+        "name": name,
+        "owner_id": owner_id,
+        "image_url": image_url,
+        "background": background
+    })
+    return cursor.lastrowid
+
+# allowing someone twice is a no-op
+def allow_user(cursor, character_id, user_id):
+    cursor.execute(
+        "INSERT OR IGNORE INTO character_permissions (character_id, user_id) VALUES (:character_id, :user_id)",
+        {"character_id": character_id, "user_id": user_id}
+    )
+
+# insert or update characters by (guild_id, character_name), rows are dicts with the characters columns
+def merge_characters(cursor, rows):
+    cursor.executemany('''
+        INSERT INTO characters (guild_id, character_name, owner_id, image_url, background)
+        VALUES (:guild_id, :character_name, :owner_id, :image_url, :background)
+        ON CONFLICT (guild_id, character_name) DO UPDATE SET
+            owner_id = excluded.owner_id, image_url = excluded.image_url, background = excluded.background
+    ''', rows)
+
+### INVENTORY ###
+
+def insert_items(cursor, rows):
+    cursor.executemany('''
+        INSERT INTO inventory (character_id, name, quantity, info, price, discount, discount_threshold)
+        VALUES (:character_id, :name, :quantity, :info, :price, :discount, :discount_threshold)
+    ''', rows)
+
+# Upsert one item per row. Fields left empty keep their current value, or the /add_inventory default for new items.
+# Restocking adds the quantity to the current stock instead of replacing it.
+# The update refers to the binds rather than excluded.*, which already has the defaults filled in.
+UPSERT_ITEM_SQL = '''
+    INSERT INTO inventory (character_id, name, quantity, info, price, discount, discount_threshold)
+    VALUES (:character_id, :name, COALESCE(:quantity, 0), :info, COALESCE(:price, 1), COALESCE(:discount, 0), COALESCE(:discount_threshold, 0))
+    ON CONFLICT (character_id, name) DO UPDATE SET
+        quantity = {quantity}, info = COALESCE(:info, info), price = COALESCE(:price, price),
+        discount = COALESCE(:discount, discount), discount_threshold = COALESCE(:discount_threshold, discount_threshold)
+'''
+UPSERT_SQL = {
+    'update': UPSERT_ITEM_SQL.format(quantity='COALESCE(:quantity, quantity)'),
+    'restock': UPSERT_ITEM_SQL.format(quantity='quantity + COALESCE(:quantity, 0)'),
+}
+
+def upsert_items(cursor, rows, mode):
+    cursor.executemany(UPSERT_SQL[mode], rows)
+
+# Take quantity out of stock only if enough is left. The transaction holds the write lock,
+# so the stock read back is the one this UPDATE left.
+# Returns the remaining stock, or None if there wasn't enough.
+def purchase_item(cursor, item_id, quantity):
+    cursor.execute(
+        "UPDATE inventory SET quantity = quantity - :quantity WHERE id = :id AND quantity >= :quantity",
+        {'quantity': quantity, 'id': item_id}
+    )
+    if cursor.rowcount == 0:
+        return None
+    cursor.execute("SELECT quantity FROM inventory WHERE id = :id", {'id': item_id})
+    return cursor.fetchone()[0]
+
+### WEBHOOKS ###
+
+def save_webhook(cursor, channel_id, guild_id, webhook_url):
+    cursor.execute('''
+        INSERT INTO webhooks (channel_id, guild_id, webhook_url) VALUES (:channel_id, :guild_id, :webhook_url)
+        ON CONFLICT (channel_id) DO UPDATE SET webhook_url = excluded.webhook_url
+    ''', {'channel_id': channel_id, 'guild_id': guild_id, 'webhook_url': webhook_url})
+
+### GUILD CONFIG ###
+
+# column is one of the guild_config setting columns, never user input
+def save_guild_setting(cursor, guild_id, column, value):
+    cursor.execute(f'''
+        INSERT INTO guild_config (guild_id, {column}) VALUES (:guild_id, :value)
+        ON CONFLICT (guild_id) DO UPDATE SET {column} = excluded.{column}
+    ''', {'guild_id': guild_id, 'value': value})
@@ -0,0 +1,30 @@
+from commands import create_oracle_connection
+
+# The original characters table, which bot.py used to create on every start.
+# Databases created that way already have it, so this only creates it on a fresh database.
+def up():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    cursor.execute("SELECT table_name FROM user_tables WHERE table_name = 'CHARACTERS'")
+    if not cursor.fetchone():
+        cursor.execute('''
+            CREATE TABLE characters (
+                guild_id VARCHAR2(50),
+                character_name VARCHAR2(50),
+                owner_id VARCHAR2(50),
+                image_url VARCHAR2(255),
+                background VARCHAR2(1000),
+                allowed_users CLOB
+            )
+        ''')
+        connection.commit()
+    cursor.close()
+    connection.close()
+
+def down():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE characters")
+    connection.commit()
+    cursor.close()
+    connection.close()
@@ -0,0 +1,34 @@
+from commands import create_oracle_connection
+
+def up():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    # Re-running /init used to insert every character again, so drop duplicates before adding the unique indexes.
+    # Items of a duplicate character move to the oldest copy, then duplicate items are dropped the same way.
+    cursor.execute("""
+        UPDATE inventory i SET i.character_id = (
+            SELECT MIN(c2.id) FROM characters c1, characters c2
+            WHERE c1.id = i.character_id AND c2.guild_id = c1.guild_id AND c2.character_name = c1.character_name
+        )
+    """)
+    cursor.execute("DELETE FROM inventory WHERE id NOT IN (SELECT MIN(id) FROM inventory GROUP BY character_id, name)")
+    cursor.execute("DELETE FROM characters WHERE id NOT IN (SELECT MIN(id) FROM characters GROUP BY guild_id, character_name)")
+    cursor.execute("CREATE UNIQUE INDEX characters_guild_name_uk ON characters (guild_id, character_name)")
+    # character_id leads this index, so it also covers lookups and cascades on inventory.character_id alone
+    cursor.execute("CREATE UNIQUE INDEX inventory_character_name_uk ON inventory (character_id, name)")
+    cursor.execute("ALTER TABLE inventory DROP CONSTRAINT inventory_fk")
+    cursor.execute("ALTER TABLE inventory ADD CONSTRAINT inventory_fk FOREIGN KEY (character_id) REFERENCES characters(id) ON DELETE CASCADE")
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+def down():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    cursor.execute("ALTER TABLE inventory DROP CONSTRAINT inventory_fk")
+    cursor.execute("ALTER TABLE inventory ADD CONSTRAINT inventory_fk FOREIGN KEY (character_id) REFERENCES characters(id)")
+    cursor.execute("DROP INDEX inventory_character_name_uk")
+    cursor.execute("DROP INDEX characters_guild_name_uk")
+    connection.commit()
+    cursor.close()
+    connection.close()
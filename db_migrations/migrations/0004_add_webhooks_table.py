@@ -0,0 +1,19 @@
+from commands import create_oracle_connection
+
+def up():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    # one character webhook per channel, so /speak_as doesn't have to list the channel's webhooks every time
+    cursor.execute("CREATE TABLE webhooks (channel_id VARCHAR2(50) NOT NULL, guild_id VARCHAR2(50) NOT NULL, webhook_url VARCHAR2(255) NOT NULL)")
+    cursor.execute("ALTER TABLE webhooks ADD CONSTRAINT webhooks_pk PRIMARY KEY (channel_id)")
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+def down():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE webhooks")
+    connection.commit()
+    cursor.close()
+    connection.close()
@@ -0,0 +1,39 @@
+from commands import create_oracle_connection
+
+def up():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    # who may use a character, one row per user, replacing the allowed_users JSON CLOB.
+    # Index-organized so a permission check is a single primary key probe.
+    cursor.execute("""
+        CREATE TABLE character_permissions (
+            character_id NUMBER(10) NOT NULL,
+            user_id VARCHAR2(50) NOT NULL,
+            CONSTRAINT character_permissions_pk PRIMARY KEY (character_id, user_id),
+            CONSTRAINT character_permissions_fk FOREIGN KEY (character_id) REFERENCES characters(id) ON DELETE CASCADE
+        ) ORGANIZATION INDEX
+    """)
+    cursor.execute("""
+        INSERT INTO character_permissions (character_id, user_id)
+        SELECT DISTINCT c.id, j.user_id
+        FROM characters c, JSON_TABLE(c.allowed_users, '$[*]' COLUMNS (user_id VARCHAR2(50) PATH '$')) j
+        WHERE j.user_id IS NOT NULL
+    """)
+    cursor.execute("ALTER TABLE characters DROP COLUMN allowed_users")
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+def down():
+    connection = create_oracle_connection()
+    cursor = connection.cursor()
+    cursor.execute("ALTER TABLE characters ADD allowed_users CLOB")
+    cursor.execute("""
+        UPDATE characters c SET c.allowed_users = NVL((
+            SELECT JSON_ARRAYAGG(p.user_id RETURNING CLOB) FROM character_permissions p WHERE p.character_id = c.id
+        ), '[]')
+    """)
+    cursor.execute("DROP TABLE character_permissions")
+    connection.commit()
+    cursor.close()
+    connection.close()
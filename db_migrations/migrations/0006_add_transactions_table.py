@@ -0,0 +1,32 @@
+# Ledger of purchases, written in the same transaction as the stock change.
+# published marks the rows whose receipt has been posted to the transactions channel.
+def up(connection):
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE transactions (
+            id NUMBER(10) GENERATED BY DEFAULT AS IDENTITY,
+            guild_id VARCHAR2(50) NOT NULL,
+            character_id NUMBER(10),
+            character_name VARCHAR2(50) NOT NULL,
+            item_name VARCHAR2(100) NOT NULL,
+            buyer_id VARCHAR2(50) NOT NULL,
+            buyer_name VARCHAR2(100),
+            quantity NUMBER(10) NOT NULL,
+            price NUMBER(10) NOT NULL,
+            discounted NUMBER(1) DEFAULT 0 NOT NULL,
+            created_at TIMESTAMP DEFAULT SYSTIMESTAMP NOT NULL,
+            published NUMBER(1) DEFAULT 0 NOT NULL,
+            CONSTRAINT transactions_pk PRIMARY KEY (id),
+            CONSTRAINT transactions_character_fk FOREIGN KEY (character_id) REFERENCES characters(id) ON DELETE SET NULL
+        )
+    """)
+    # receipts still to post, per guild in purchase order
+    cursor.execute("CREATE INDEX transactions_pending_ix ON transactions (published, guild_id, id)")
+    # deleting a character updates its sales, don't scan the ledger for them
+    cursor.execute("CREATE INDEX transactions_character_ix ON transactions (character_id)")
+    cursor.close()
+
+def down(connection):
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE transactions")
+    cursor.close()
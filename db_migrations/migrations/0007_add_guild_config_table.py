@@ -0,0 +1,18 @@
+# Per-guild settings, for now the IDs of the backup and transactions channels so they are found with
+# guild.get_channel instead of a search by name, and keep working when they are renamed.
+def up(connection):
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE guild_config (
+            guild_id VARCHAR2(50) NOT NULL,
+            backup_channel_id VARCHAR2(50),
+            transaction_channel_id VARCHAR2(50),
+            CONSTRAINT guild_config_pk PRIMARY KEY (guild_id)
+        )
+    """)
+    cursor.close()
+
+def down(connection):
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE guild_config")
+    cursor.close()
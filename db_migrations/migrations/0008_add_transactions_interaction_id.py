@@ -0,0 +1,10 @@
+# The interaction a purchase was made in, so the lines of one /buy cart are posted as one receipt
+def up(connection):
+    cursor = connection.cursor()
+    cursor.execute("ALTER TABLE transactions ADD interaction_id VARCHAR2(50)")
+    cursor.close()
+
+def down(connection):
+    cursor = connection.cursor()
+    cursor.execute("ALTER TABLE transactions DROP COLUMN interaction_id")
+    cursor.close()
@@ -1,94 +1,188 @@
-# go through each python file in /migrations and run up() function
-# if the file has not been run before, add it to the migrations table
-# if the file has been run before, skip it
-# if the file has been run before but the hash has changed, raise an error
-# if the file has not been run before but the hash has changed, raise an error
-# if there are any errors, rollback all migrations
-# if all migrations run successfully, commit all migrations
+# Runs every migration in migrations/ that hasn't been run yet, in a fixed order, and records it in the migrations table.
+# A migration that has been run before but whose file changed since is an error: applied migrations are never edited.
+#
+# The runner holds one pooled connection. It reads the applied migrations in one query, so a start-up with nothing
+# to do is a single round trip. When there is work it takes an advisory lock first, so bot replicas starting at the same
+# time don't run the same migration twice or both create the migrations table of a fresh database.
+#
+# Migrations define up() and down(). Newer ones take the runner's connection, up(connection), and leave committing to
+# the runner, which commits their changes together with the migrations row. Older ones open their own connection.
+# Oracle commits DDL implicitly, so only the DML of a migration is rolled back when it fails.
+#
+#   python3 run_migrations.py             run pending migrations
+#   python3 run_migrations.py --dry-run   list what would run without changing anything
+#   python3 run_migrations.py --down [N]  undo the last N applied migrations (default 1)
 
+import argparse
 import os
 import sys
 import hashlib
 import importlib.util
+import inspect
+
+import oracledb
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if parent_dir not in sys.path:
     sys.path.append(parent_dir)
     print(f"Added {parent_dir} to sys.path")
 
-from commands import create_oracle_connection
+from commands import create_oracle_connection, close_pool
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+LOCK_NAME = 'NPC_MIGRATIONS'
+# seconds to wait for another replica to finish migrating
+LOCK_TIMEOUT = int(os.environ.get('MIGRATION_LOCK_TIMEOUT', 300))
+
+# the base characters table and the migrations written before files were numbered, in the order they have to run
+LEGACY_MIGRATIONS = ['0001_create_characters_table.py', 'add_id_to_characters.py', 'add_inventory_table.py']
+
+# legacy migrations first, then the other numbered ones (0003_..., 0004_...) in filename order
+def migration_order(file):
+    if file in LEGACY_MIGRATIONS:
+        return (0, LEGACY_MIGRATIONS.index(file), file)
+    return (1, 0, file)
 
 def get_migration_files():
     migration_files = []
-    for file in os.listdir('migrations'):
+    for file in os.listdir(MIGRATIONS_DIR):
         if file.endswith('.py'):
             migration_files.append(file)
-    return migration_files
+    return sorted(migration_files, key=migration_order)
 
 def get_migration_hash(file):
-    with open(f'migrations/{file}', 'r') as f:
+    with open(os.path.join(MIGRATIONS_DIR, file), 'r') as f:
         file_contents = f.read()
         return hashlib.md5(file_contents.encode()).hexdigest()
-    
-def get_migration_status(file):
-    connection = create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM migrations WHERE filename = :filename", {'filename': file})
-    result = cursor.fetchone()
-    cursor.close()
-    return result
-
-def run_migration(file):
-    spec = importlib.util.spec_from_file_location(file, f'migrations/{file}')
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    module.up()
 
-def add_migration_to_table(file, hash):
-    connection = create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("INSERT INTO migrations (filename, hash) VALUES (:filename, :hash)", {'filename': file, 'hash': hash})
-    connection.commit()
-    cursor.close()
-
-def main():
-    # Ensure current directory is db_migrations
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    os.chdir(current_dir)
-
-    # check if migrations table exists, create if not
-    print('Checking if migrations table exists...', flush=True)
-    connection = create_oracle_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT table_name FROM user_tables WHERE table_name = 'MIGRATIONS'")
-    result = cursor.fetchone()
-    if not result:
+# {filename: hash} of every applied migration. On a fresh database the migrations table is only created if create is
+# set, which is done under the migration lock, so replicas starting together don't both try to create it.
+def get_applied_migrations(cursor, create=False):
+    try:
+        cursor.execute("SELECT filename, hash FROM migrations")
+    except oracledb.DatabaseError as e:
+        error, = e.args
+        # ORA-00942: table or view does not exist
+        if error.code != 942:
+            raise
+        if not create:
+            return {}
         cursor.execute("CREATE TABLE migrations (filename VARCHAR2(255), hash VARCHAR2(255))")
-        connection.commit()
         print('Migrations table created successfully')
-    cursor.close()
+        return {}
+    return dict(cursor.fetchall())
+
+def load_migration(file):
+    spec = importlib.util.spec_from_file_location(file, os.path.join(MIGRATIONS_DIR, file))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
-    print('Running migrations...')
-    migration_files = get_migration_files()
-    print(f"Found {len(migration_files)} migration files")
-    for file in migration_files:
+# call up() or down(), handing over the connection if the migration takes one
+def call_migration(function, connection):
+    if inspect.signature(function).parameters:
+        function(connection)
+    else:
+        function()
+
+def pending_migrations(applied):
+    pending = []
+    for file in get_migration_files():
         hash = get_migration_hash(file)
-        status = get_migration_status(file)
-        if status:
-            if status[1] != hash:
+        if file in applied:
+            if applied[file] != hash:
                 raise Exception(f"Migration {file} has been run before, but the hash has changed")
-            else:
-                print(f"Migration {file} has already been run")
         else:
-            run_migration(file)
-            add_migration_to_table(file, hash)
-            print(f"Migration {file} has been run successfully")
-    print('All migrations have been run successfully')
+            pending.append((file, hash))
+    return pending
+
+# Session-level lock shared by every replica using this database, released explicitly (not on commit)
+# because migrations commit as they go
+def acquire_lock(cursor):
+    status = cursor.var(int)
+    cursor.execute('''
+        DECLARE
+            handle VARCHAR2(128);
+        BEGIN
+            DBMS_LOCK.ALLOCATE_UNIQUE(:name, handle);
+            :status := DBMS_LOCK.REQUEST(handle, DBMS_LOCK.X_MODE, :timeout, FALSE);
+        END;
+    ''', {'name': LOCK_NAME, 'timeout': LOCK_TIMEOUT, 'status': status})
+    # 0 = granted, 4 = this session already holds it
+    if status.getvalue() not in (0, 4):
+        raise Exception(f"Could not get the migration lock within {LOCK_TIMEOUT} seconds (DBMS_LOCK status {status.getvalue()})")
+
+def release_lock(cursor):
+    cursor.execute('''
+        DECLARE
+            handle VARCHAR2(128);
+            status INTEGER;
+        BEGIN
+            DBMS_LOCK.ALLOCATE_UNIQUE(:name, handle);
+            status := DBMS_LOCK.RELEASE(handle);
+        END;
+    ''', {'name': LOCK_NAME})
+
+def migrate_up(connection, cursor, pending):
+    for file, hash in pending:
+        try:
+            call_migration(load_migration(file).up, connection)
+            cursor.execute("INSERT INTO migrations (filename, hash) VALUES (:filename, :hash)", {'filename': file, 'hash': hash})
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        print(f"Migration {file} has been run successfully")
+
+def migrate_down(connection, cursor, applied, steps):
+    for file in sorted(applied, key=migration_order, reverse=True)[:steps]:
+        try:
+            call_migration(load_migration(file).down, connection)
+            cursor.execute("DELETE FROM migrations WHERE filename = :filename", {'filename': file})
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        print(f"Migration {file} has been undone")
 
-    connection.close()
-    
-    # Move back to parent directory
-    os.chdir('..')
+def main(dry_run=False, down=0):
+    connection = create_oracle_connection()
+    try:
+        cursor = connection.cursor()
+        applied = get_applied_migrations(cursor)
+        if down:
+            targets = sorted(applied, key=migration_order, reverse=True)[:down]
+        else:
+            targets = [file for file, _ in pending_migrations(applied)]
+
+        if dry_run:
+            action = 'undo' if down else 'run'
+            print(f"{len(applied)} migrations applied, would {action} {len(targets)}: {', '.join(targets) or 'nothing'}")
+            return
+        if not targets:
+            print(f"All {len(applied)} migrations have already been run")
+            return
+
+        acquire_lock(cursor)
+        try:
+            # another replica may have migrated while we waited for the lock
+            applied = get_applied_migrations(cursor, create=True)
+            if down:
+                migrate_down(connection, cursor, applied, down)
+            else:
+                migrate_up(connection, cursor, pending_migrations(applied))
+                print('All migrations have been run successfully')
+        finally:
+            release_lock(cursor)
+    finally:
+        connection.close()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run or undo database migrations")
+    parser.add_argument('--dry-run', action='store_true', help="list the migrations that would run without running them")
+    parser.add_argument('--down', nargs='?', type=int, const=1, default=0, metavar='N', help="undo the last N applied migrations (default 1)")
+    args = parser.parse_args()
+    try:
+        main(dry_run=args.dry_run, down=args.down)
+    finally:
+        close_pool()
@@ -0,0 +1,36 @@
+-- The schema the Oracle migrations up to 0005 build, for the embedded SQLite backend.
+-- New files are numbered like the Oracle migrations and applied in order; PRAGMA user_version records the last one.
+
+CREATE TABLE characters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    character_name TEXT NOT NULL,
+    owner_id TEXT,
+    image_url TEXT,
+    background TEXT
+);
+CREATE UNIQUE INDEX characters_guild_name_uk ON characters (guild_id, character_name);
+
+CREATE TABLE inventory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    character_id INTEGER NOT NULL REFERENCES characters (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    info TEXT,
+    price INTEGER NOT NULL,
+    discount INTEGER,
+    discount_threshold INTEGER
+);
+CREATE UNIQUE INDEX inventory_character_name_uk ON inventory (character_id, name);
+
+CREATE TABLE character_permissions (
+    character_id INTEGER NOT NULL REFERENCES characters (id) ON DELETE CASCADE,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (character_id, user_id)
+) WITHOUT ROWID;
+
+CREATE TABLE webhooks (
+    channel_id TEXT PRIMARY KEY,
+    guild_id TEXT NOT NULL,
+    webhook_url TEXT NOT NULL
+);
@@ -0,0 +1,18 @@
+-- Ledger of purchases, written in the same transaction as the stock change.
+-- published marks the rows whose receipt has been posted to the transactions channel.
+CREATE TABLE transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    character_id INTEGER REFERENCES characters (id) ON DELETE SET NULL,
+    character_name TEXT NOT NULL,
+    item_name TEXT NOT NULL,
+    buyer_id TEXT NOT NULL,
+    buyer_name TEXT,
+    quantity INTEGER NOT NULL,
+    price INTEGER NOT NULL,
+    discounted INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    published INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX transactions_pending_ix ON transactions (published, guild_id, id);
+CREATE INDEX transactions_character_ix ON transactions (character_id);
@@ -0,0 +1,7 @@
+-- Per-guild settings, for now the IDs of the backup and transactions channels so they are found with
+-- guild.get_channel instead of a search by name, and keep working when they are renamed.
+CREATE TABLE guild_config (
+    guild_id TEXT PRIMARY KEY,
+    backup_channel_id TEXT,
+    transaction_channel_id TEXT
+) WITHOUT ROWID;
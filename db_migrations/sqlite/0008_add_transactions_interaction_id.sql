@@ -0,0 +1,2 @@
+-- The interaction a purchase was made in, so the lines of one /buy cart are posted as one receipt
+ALTER TABLE transactions ADD COLUMN interaction_id TEXT;
@@ -0,0 +1,56 @@
+-- Generated ids become AUTOINCREMENT, so a deleted row's id is never handed out again, like Oracle identity columns.
+-- Plain INTEGER PRIMARY KEY reuses the id of the newest row once it is deleted, which let cached permission checks
+-- and ledger rows of a deleted character point at the next character created.
+-- SQLite can't change a column in place, so the tables are rebuilt; databases whose 0001 and 0006 already
+-- created them with AUTOINCREMENT are rebuilt unchanged. Runs with foreign keys off, see migrate().
+CREATE TABLE characters_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    character_name TEXT NOT NULL,
+    owner_id TEXT,
+    image_url TEXT,
+    background TEXT
+);
+INSERT INTO characters_new (id, guild_id, character_name, owner_id, image_url, background)
+    SELECT id, guild_id, character_name, owner_id, image_url, background FROM characters;
+DROP TABLE characters;
+ALTER TABLE characters_new RENAME TO characters;
+CREATE UNIQUE INDEX characters_guild_name_uk ON characters (guild_id, character_name);
+
+CREATE TABLE inventory_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    character_id INTEGER NOT NULL REFERENCES characters (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    info TEXT,
+    price INTEGER NOT NULL,
+    discount INTEGER,
+    discount_threshold INTEGER
+);
+INSERT INTO inventory_new (id, character_id, name, quantity, info, price, discount, discount_threshold)
+    SELECT id, character_id, name, quantity, info, price, discount, discount_threshold FROM inventory;
+DROP TABLE inventory;
+ALTER TABLE inventory_new RENAME TO inventory;
+CREATE UNIQUE INDEX inventory_character_name_uk ON inventory (character_id, name);
+
+CREATE TABLE transactions_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    character_id INTEGER REFERENCES characters (id) ON DELETE SET NULL,
+    character_name TEXT NOT NULL,
+    item_name TEXT NOT NULL,
+    buyer_id TEXT NOT NULL,
+    buyer_name TEXT,
+    quantity INTEGER NOT NULL,
+    price INTEGER NOT NULL,
+    discounted INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    published INTEGER NOT NULL DEFAULT 0,
+    interaction_id TEXT
+);
+INSERT INTO transactions_new (id, guild_id, character_id, character_name, item_name, buyer_id, buyer_name, quantity, price, discounted, created_at, published, interaction_id)
+    SELECT id, guild_id, character_id, character_name, item_name, buyer_id, buyer_name, quantity, price, discounted, created_at, published, interaction_id FROM transactions;
+DROP TABLE transactions;
+ALTER TABLE transactions_new RENAME TO transactions;
+CREATE INDEX transactions_pending_ix ON transactions (published, guild_id, id);
+CREATE INDEX transactions_character_ix ON transactions (character_id);
@@ -0,0 +1,95 @@
+# Runs the bot as several processes, each with its own range of shards, so busy guilds on one shard don't
+# hold up the others and the bot can use more than one core.
+#
+# Every worker is a normal bot.py with SHARD_COUNT and SHARD_IDS set and the same environment otherwise,
+# so each opens its own Oracle pool from the same ORACLE_* settings (up to processes x ORACLE_POOL_MAX sessions).
+# The exception is METRICS_PORT: worker N serves its metrics on METRICS_PORT + N.
+# Workers that exit are restarted.
+#
+#   python3 launcher.py [--processes N] [--shards N]
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+
+import aiohttp
+
+from commands.shards import format_shard_ids
+
+BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+# Discord allows max_concurrency identifies per 5 seconds
+IDENTIFY_WINDOW = 5
+RESTART_DELAY = 10
+
+# recommended shard count and identify concurrency for this bot
+async def gateway_info(token):
+    async with aiohttp.ClientSession() as session:
+        async with session.get('https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {token}'}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data['shards'], data['session_start_limit']['max_concurrency']
+
+# split shards into contiguous ranges, one per process
+def shard_ranges(shard_count, processes):
+    processes = min(processes, shard_count)
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+async def run_worker(index, shard_count, shard_ids, stopping):
+    env = {**os.environ, 'SHARD_COUNT': str(shard_count), 'SHARD_IDS': ','.join(map(str, shard_ids))}
+    # every worker serves its own metrics, on METRICS_PORT + its index
+    if os.environ.get('METRICS_PORT'):
+        env['METRICS_PORT'] = str(int(os.environ['METRICS_PORT']) + index)
+    name = f"shards {format_shard_ids(shard_ids)}"
+    while not stopping.is_set():
+        process = await asyncio.create_subprocess_exec(sys.executable, BOT, env=env)
+        print(f"Launcher: started {name} (pid {process.pid})", flush=True)
+        stop = asyncio.ensure_future(stopping.wait())
+        exited = asyncio.ensure_future(process.wait())
+        await asyncio.wait([stop, exited], return_when=asyncio.FIRST_COMPLETED)
+        if stopping.is_set():
+            exited.cancel()
+            # SIGINT, which discord.py turns into a clean close, so the worker flushes its pending backups and receipts
+            process.send_signal(signal.SIGINT)
+            await process.wait()
+            return
+        stop.cancel()
+        print(f"Launcher: {name} exited with code {process.returncode}, restarting in {RESTART_DELAY} s", flush=True)
+        await asyncio.sleep(RESTART_DELAY)
+
+async def main(processes, shard_count):
+    token = os.environ.get('DISCORD_TOKEN')
+    recommended, max_concurrency = await gateway_info(token)
+    shard_count = shard_count or recommended
+    ranges = shard_ranges(shard_count, processes)
+    print(f"Launcher: {shard_count} shards over {len(ranges)} processes (Discord recommends {recommended})", flush=True)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    workers = []
+    for index, shard_ids in enumerate(ranges):
+        if index:
+            # let the previous worker identify its shards first, or they share the identify rate limit
+            await asyncio.sleep(IDENTIFY_WINDOW * -(-len(ranges[index - 1]) // max_concurrency))
+        if stopping.is_set():
+            break
+        workers.append(asyncio.create_task(run_worker(index, shard_count, shard_ids, stopping)))
+    await asyncio.gather(*workers)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bot's shards in several processes")
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('BOT_PROCESSES', os.cpu_count() or 1)), help="worker processes (default: BOT_PROCESSES or the number of cores)")
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('SHARD_COUNT', 0)), help="total shards (default: SHARD_COUNT or Discord's recommendation)")
+    args = parser.parse_args()
+    asyncio.run(main(args.processes, args.shards))